@@ -0,0 +1,44 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Handles of the periodic loops, cancelled by stop_periodic() on shutdown
+_periodic_tasks = []
+
+
+def start_periodic(interval: float, func, name: str):
+    """Run `await func()` every `interval` seconds until stop_periodic().
+
+    Safe to call from post_init: the loop is a plain asyncio task tracked
+    here rather than by the Application, which only tracks tasks once it is
+    running.
+    """
+
+    async def loop():
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await func()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Periodic job '{name}' failed: {e}", exc_info=True)
+
+    task = asyncio.create_task(loop(), name=name)
+    _periodic_tasks.append(task)
+    return task
+
+
+async def cancel_and_wait(tasks) -> None:
+    """Cancel the given tasks and wait until they have finished."""
+    tasks = [task for task in tasks if task is not None]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def stop_periodic() -> None:
+    """Cancel every periodic loop and wait for it to exit."""
+    await cancel_and_wait(_periodic_tasks)
+    _periodic_tasks.clear()
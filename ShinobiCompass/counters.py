@@ -0,0 +1,61 @@
+"""Materialized counters for /stats.
+
+A single `counters` document is kept up to date with `$inc` by the code paths
+that add or remove users, verifications, groups, tasks and listings, so
+reading the totals is one point lookup. `reconcile_counters()` recounts the
+collections periodically to correct any drift (e.g. manual edits in the
+database or a crash between a write and its increment).
+"""
+import logging
+import os
+
+from ShinobiCompass.database import db
+
+logger = logging.getLogger(__name__)
+
+counters_collection = db["counters"]
+STATS_COUNTERS_ID = "stats"
+
+COUNTERS_RECONCILE_INTERVAL = int(os.getenv("COUNTERS_RECONCILE_INTERVAL", "3600"))  # seconds
+
+# Counter name -> (collection, filter) it materializes
+COUNTER_SOURCES = {
+    "users": ("users", {}),
+    "verified_users": ("users", {"verified": True}),
+    "groups": ("groups", {}),
+    "active_tasks": ("tasks_collection", {}),
+    "listings": ("items_for_sale", {}),
+}
+
+
+async def bump_counters(**deltas: int) -> None:
+    """Apply the given increments, e.g. bump_counters(users=1, verified_users=1)."""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    try:
+        await counters_collection.update_one({"_id": STATS_COUNTERS_ID}, {"$inc": deltas}, upsert=True)
+    except Exception as e:
+        # The next reconciliation fixes the count; the caller's write already succeeded
+        logger.error(f"Failed to update counters {deltas}: {e}")
+
+
+async def read_counters() -> dict:
+    """Return every counter, defaulting to 0."""
+    doc = await counters_collection.find_one({"_id": STATS_COUNTERS_ID}) or {}
+    return {name: doc.get(name, 0) for name in COUNTER_SOURCES}
+
+
+async def reconcile_counters() -> None:
+    """Recount every source collection and overwrite the counters."""
+    counts = {}
+    for name, (collection_name, query) in COUNTER_SOURCES.items():
+        counts[name] = await db[collection_name].count_documents(query)
+    await counters_collection.update_one({"_id": STATS_COUNTERS_ID}, {"$set": counts}, upsert=True)
+    logger.info(f"Counters reconciled: {counts}")
+
+
+async def ensure_counters() -> None:
+    """Seed the counters from a full count the first time the bot starts."""
+    if await counters_collection.find_one({"_id": STATS_COUNTERS_ID}, {"_id": 1}) is None:
+        await reconcile_counters()
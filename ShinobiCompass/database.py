@@ -1,10 +1,12 @@
 import certifi
-from pymongo import MongoClient, errors
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import errors, monitoring
+import asyncio
 import os
+import threading
 import time
 import logging
 from dotenv import load_dotenv
-import atexit
 
 # Load environment variables
 load_dotenv()
@@ -19,43 +21,146 @@ if not MONGO_URI:
 if not (":" in MONGO_URI and "@" in MONGO_URI):
     raise ValueError("MONGO_URI does not contain the required username and password.")
 
+DATABASE_NAME = "Tgbotproject"
+
+# Connection pool settings (override through the environment)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))  # 5 minutes
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))  # 10 seconds
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000"))  # 30 seconds
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))  # 10 seconds
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))  # 20 seconds
+
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Collects connection pool usage from the driver's monitoring events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.open_connections = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.monotonic()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        waited = time.monotonic() - started if started is not None else 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "max_pool_size": MONGO_MAX_POOL_SIZE,
+                "open_connections": self.open_connections,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "avg_wait_ms": (self.total_wait / self.checkouts * 1000) if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+
+pool_metrics = PoolMetrics()
+
 # MongoDB Setup
 mongo_client = None
 
-def setup_mongo(retries: int = 3, delay: int = 5):
+def setup_mongo():
+    """Create the shared async MongoDB client.
+
+    Motor connects lazily, so importing this module never blocks; the pool is
+    opened by `connect_mongo` from the application's post_init hook.
+    """
     global mongo_client
+    try:
+        # Use certifi for CA certificates
+        mongo_client = AsyncIOMotorClient(
+            MONGO_URI,
+            tls=True,
+            tlsCAFile=certifi.where(),
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            event_listeners=[pool_metrics],
+        )
+        return mongo_client
+    except Exception as e:
+        logger.critical(f"Unexpected error while creating MongoDB client: {e}", exc_info=True)
+        raise e
+
+async def connect_mongo(retries: int = 3, delay: int = 5):
+    """Open the connection pool and make sure the server is reachable."""
     attempt = 0
-    
+
     while attempt < retries:
         try:
-            logger.debug(f"Connecting to MongoDB using URI: {MONGO_URI}")
-            # Use certifi for CA certificates
-            mongo_client = MongoClient(MONGO_URI, tls=True, tlsCAFile=certifi.where(), 
-                                       serverSelectionTimeoutMS=30000,  # 30 seconds
-                                       connectTimeoutMS=10000,  # 10 seconds
-                                       socketTimeoutMS=20000)  # 20 seconds
-            mongo_client.get_database("Tgbotproject")  # Check if connection is valid
-            mongo_client.admin.command("ping")  # Ensure connection is active
+            await mongo_client.admin.command("ping")  # Ensure connection is active
             logger.info("MongoDB connected successfully.")
-            return mongo_client
+            return
         except errors.ConnectionFailure as e:
             attempt += 1
             logger.error(f"MongoDB connection attempt {attempt} failed. Error: {e}")
             if attempt < retries:
                 logger.info(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
+                await asyncio.sleep(delay)
                 delay *= 2
             else:
                 logger.critical("Failed to connect to MongoDB after multiple attempts.", exc_info=True)
                 raise e
-        except Exception as e:
-            logger.critical(f"Unexpected error while connecting to MongoDB: {e}", exc_info=True)
-            raise e
 
 def close_mongo_connection():
     """Close MongoDB connection Gracefully."""
@@ -67,13 +172,14 @@ def close_mongo_connection():
         except Exception as e:
             logger.error(f"Error closing MongoDB connection: {e}")
 
-# Set up cleanup when the bot shuts down
-atexit.register(close_mongo_connection)
+def get_pool_stats() -> dict:
+    """Return a snapshot of the connection pool metrics."""
+    return pool_metrics.snapshot()
 
 # Initialize MongoDB client and database
 try:
     mongo_client = setup_mongo()
-    db = mongo_client.get_database("Tgbotproject")
+    db = mongo_client.get_database(DATABASE_NAME)
 except Exception as e:
     logger.critical("Failed to initialize MongoDB client.", exc_info=True)
     raise e
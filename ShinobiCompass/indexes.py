@@ -0,0 +1,165 @@
+"""Index bootstrap and query-plan verification for the hot collections.
+
+Indexes are declared here per collection and created at startup through
+`ensure_indexes()`. Running this module directly also verifies, with
+`explain()`, that every hot query shape is served by an index:
+
+    python -m ShinobiCompass.indexes --check
+"""
+import asyncio
+import logging
+import sys
+from datetime import datetime
+
+import pytz
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from ShinobiCompass.database import db, connect_mongo, close_mongo_connection
+from ShinobiCompass.market import OFFER_HISTORY_TTL, POST_DEDUP_TTL
+
+logger = logging.getLogger(__name__)
+
+IST = pytz.timezone('Asia/Kolkata')
+
+# Required indexes per collection
+INDEXES = {
+    "users": [
+        IndexModel([("user_id", ASCENDING)], unique=True, name="user_id_unique"),
+    ],
+    "sudo_users": [
+        IndexModel([("user_id", ASCENDING)], unique=True, name="user_id_unique"),
+    ],
+    "tasks_collection": [
+        IndexModel([("task_id", ASCENDING)], unique=True, name="task_id_unique"),
+        IndexModel([("chat_id", ASCENDING), ("end_time", ASCENDING)], name="chat_id_end_time"),
+        IndexModel([("end_time", ASCENDING)], name="end_time"),
+    ],
+    "task_submissions": [
+        IndexModel([("task_id", ASCENDING), ("user_id", ASCENDING)], unique=True, name="task_id_user_id_unique"),
+        IndexModel([("chat_id", ASCENDING)], name="chat_id"),
+    ],
+    "clans": [
+        IndexModel([("name", ASCENDING)], unique=True, name="name_unique"),
+    ],
+    "items_for_sale": [
+        IndexModel([("seller_id", ASCENDING), ("category", ASCENDING)], name="seller_id_category"),
+    ],
+    "groups": [
+        IndexModel([("group_id", ASCENDING)], unique=True, name="group_id_unique"),
+    ],
+    "scheduled_jobs": [
+        IndexModel([("status", ASCENDING), ("run_at", ASCENDING)], name="status_run_at"),
+        IndexModel([("payload.chat_id", ASCENDING)], sparse=True, name="payload_chat_id"),
+        IndexModel([("status", ASCENDING), ("queued_at", ASCENDING)], name="status_queued_at"),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_lease_until"),
+    ],
+    "broadcasts": [
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_lease_until"),
+    ],
+    "bm_offers": [
+        IndexModel([("item", ASCENDING), ("hour", ASCENDING)], unique=True, name="item_hour_unique"),
+        IndexModel([("hour", ASCENDING)], expireAfterSeconds=OFFER_HISTORY_TTL, name="hour_ttl"),
+    ],
+    "bm_posts": [
+        IndexModel([("seen_at", ASCENDING)], expireAfterSeconds=POST_DEDUP_TTL, name="seen_at_ttl"),
+    ],
+    "rate_state": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+        IndexModel([("block_end_time", ASCENDING)], sparse=True, name="block_end_time"),
+    ],
+}
+
+
+def hot_queries() -> list[tuple[str, dict]]:
+    """Return the (collection, filter) shapes issued on the hot paths."""
+    now = datetime.now(IST)
+    return [
+        ("users", {"user_id": 0}),
+        ("users", {"user_id": {"$gt": 0}}),
+        ("sudo_users", {"user_id": 0}),
+        ("tasks_collection", {"task_id": "00000"}),
+        ("tasks_collection", {"chat_id": 0, "end_time": {"$gt": now}}),
+        ("tasks_collection", {"chat_id": 0, "end_time": {"$lt": now}}),
+        ("tasks_collection", {"chat_id": 0, "start_time": {"$lt": now}, "end_time": {"$gt": now}}),
+        ("tasks_collection", {"end_time": {"$gt": now}}),
+        ("task_submissions", {"task_id": "00000", "user_id": 0}),
+        ("task_submissions", {"task_id": "00000", "linv": {"$exists": True}}),
+        ("clans", {"name": "", "authorized": True}),
+        ("items_for_sale", {"seller_id": 0}),
+        ("items_for_sale", {"seller_id": 0, "category": ""}),
+        ("groups", {"group_id": 0}),
+        ("scheduled_jobs", {"status": "pending"}),
+        ("scheduled_jobs", {"status": "pending", "queued_at": {"$gte": datetime.utcnow()}}),
+        ("scheduled_jobs", {"status": "running", "lease_until": {"$lt": datetime.utcnow()}}),
+        ("scheduled_jobs", {"payload.chat_id": 0, "status": "pending"}),
+        ("broadcasts", {"status": "running", "$or": [{"lease_until": {"$lt": datetime.utcnow()}}, {"lease_until": None}]}),
+        ("broadcasts", {
+            "_id": ObjectId(),
+            "status": "running",
+            "$or": [{"owner": ""}, {"lease_until": {"$lt": datetime.utcnow()}}, {"lease_until": None}],
+        }),
+        ("rate_state", {"block_end_time": {"$gt": datetime.utcnow()}}),
+        ("bm_offers", {"hour": {"$gte": datetime.utcnow()}}),
+        ("bm_offers", {"item": "", "hour": datetime.utcnow()}),
+    ]
+
+
+async def ensure_indexes() -> None:
+    """Create every declared index; existing indexes are left untouched."""
+    for collection_name, models in INDEXES.items():
+        try:
+            created = await db[collection_name].create_indexes(models)
+            logger.info(f"Indexes ready on '{collection_name}': {', '.join(created)}")
+        except OperationFailure as e:
+            # A duplicate key in existing data must not keep the bot from starting
+            logger.error(f"Failed to create indexes on '{collection_name}': {e}")
+
+
+def _plan_stages(plan: dict):
+    """Yield every stage name of a (possibly nested) query plan."""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+async def check_query_plans() -> list[str]:
+    """Explain each hot query shape and return the ones that scan a collection."""
+    failures = []
+    for collection_name, query in hot_queries():
+        explanation = await db[collection_name].find(query).explain()
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        stages = list(_plan_stages(winning_plan))
+        if "COLLSCAN" in stages:
+            failures.append(f"{collection_name}: {query}")
+            logger.error(f"COLLSCAN on '{collection_name}' for {query}")
+        else:
+            logger.info(f"'{collection_name}' {query} -> {' <- '.join(stages)}")
+    return failures
+
+
+async def _main(check: bool) -> int:
+    await connect_mongo()
+    try:
+        await ensure_indexes()
+        if check:
+            failures = await check_query_plans()
+            if failures:
+                print("Queries falling back to COLLSCAN:\n" + "\n".join(failures))
+                return 1
+            print("All hot queries use an index.")
+        return 0
+    finally:
+        close_mongo_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main("--check" in sys.argv[1:])))
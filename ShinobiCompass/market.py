@@ -0,0 +1,158 @@
+"""Black market offer history and rolling price statistics.
+
+Every offer parsed from a black market post is recorded twice:
+
+- in memory, in a bounded rolling window per item kept in sorted order, so
+  the median and other percentiles are read in O(1);
+- in the `bm_offers` collection, one bucket document per item per hour,
+  written in batches by `flush_offers()`.
+
+A post is recorded only once across all replicas: its content hash is
+inserted into `bm_posts` first, and copies forwarded into other groups or
+analyzed again later fail that insert. The hashes expire after
+POST_DEDUP_TTL.
+
+On startup the windows are warmed from the most recent buckets. Once an item
+has MIN_SAMPLES offers, `reference_prices` holds its deal threshold (a low
+percentile of recent unit prices) and median, and the black market analysis
+judges offers against them instead of the fixed constants. Items are the
+canonical item names, e.g. one per shinobi for awaken cards.
+"""
+import bisect
+import logging
+import os
+from collections import deque
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from ShinobiCompass.database import db
+
+logger = logging.getLogger(__name__)
+
+offers_collection = db["bm_offers"]
+posts_collection = db["bm_posts"]  # {_id: content hash, seen_at} of every recorded post
+
+OFFER_WINDOW = int(os.getenv("BM_OFFER_WINDOW", "200"))  # Offers per item in the rolling window
+MIN_SAMPLES = int(os.getenv("BM_MIN_SAMPLES", "20"))  # Offers needed before the history is trusted
+DEAL_PERCENTILE = float(os.getenv("BM_DEAL_PERCENTILE", "0.25"))  # Offers below this percentile are deals
+OFFER_FLUSH_INTERVAL = int(os.getenv("BM_OFFER_FLUSH_INTERVAL", "30"))  # seconds
+OFFER_WARMUP_HOURS = 7 * 24  # History loaded into the windows at startup
+BUCKET_SAMPLE_LIMIT = 100  # Unit prices kept per hourly bucket
+OFFER_HISTORY_TTL = 90 * 24 * 60 * 60  # Buckets expire after 90 days
+POST_DEDUP_TTL = 7 * 24 * 60 * 60  # A post seen again within a week is not recorded again
+
+
+class RollingQuantile:
+    """The last `window` values of a series, kept sorted for O(1) percentiles."""
+
+    __slots__ = ("window", "_values", "_sorted")
+
+    def __init__(self, window: int):
+        self.window = window
+        self._values = deque()
+        self._sorted = []
+
+    def add(self, value: float) -> None:
+        if len(self._values) == self.window:
+            oldest = self._values.popleft()
+            del self._sorted[bisect.bisect_left(self._sorted, oldest)]
+        self._values.append(value)
+        bisect.insort(self._sorted, value)
+
+    def quantile(self, q: float) -> float | None:
+        if not self._sorted:
+            return None
+        return self._sorted[int(q * (len(self._sorted) - 1))]
+
+    def median(self) -> float | None:
+        return self.quantile(0.5)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+# Item -> rolling window of unit prices (stocks per unit)
+price_windows: dict[str, RollingQuantile] = {}
+
+# Item -> (deal threshold, median, samples) in unit prices, for items with
+# enough history. Entries are replaced whole, so the analysis can read them
+# from a worker thread.
+reference_prices: dict[str, tuple[float, float, int]] = {}
+
+# Offers waiting for the next flush: (item, hour) -> list of unit prices
+_pending: dict[tuple[str, datetime], list[float]] = {}
+
+
+def _observe(item: str, unit_price: float) -> None:
+    window = price_windows.get(item)
+    if window is None:
+        window = price_windows[item] = RollingQuantile(OFFER_WINDOW)
+    window.add(unit_price)
+    if len(window) >= MIN_SAMPLES:
+        reference_prices[item] = (window.quantile(DEAL_PERCENTILE), window.median(), len(window))
+
+
+def record_offers(offers: list[tuple[str, int, float]]) -> None:
+    """Record (item, quantity, price in stocks) offers in memory and queue them for storage."""
+    hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    for item, quantity, price in offers:
+        if quantity <= 0:
+            continue
+        unit_price = price / quantity
+        _observe(item, unit_price)
+        _pending.setdefault((item, hour), []).append(unit_price)
+
+
+async def record_post(post_hash: str, offers: list[tuple[str, int, float]]) -> bool:
+    """Record a post's offers unless this post was already recorded; True if it was recorded now."""
+    if not offers:
+        return False
+    try:
+        await posts_collection.insert_one({"_id": post_hash, "seen_at": datetime.utcnow()})
+    except DuplicateKeyError:
+        return False
+    except Exception as e:
+        logger.error(f"Failed to record black market post {post_hash}: {e}")
+        return False
+    record_offers(offers)
+    return True
+
+
+async def flush_offers() -> None:
+    """Write the queued offers, one upsert per item and hour bucket."""
+    global _pending
+    if not _pending:
+        return
+
+    batch, _pending = _pending, {}
+    requests = [
+        UpdateOne(
+            {"item": item, "hour": hour},
+            {
+                "$push": {"samples": {"$each": prices, "$slice": -BUCKET_SAMPLE_LIMIT}},
+                "$inc": {"count": len(prices), "total": sum(prices)},
+                "$min": {"min": min(prices)},
+                "$max": {"max": max(prices)},
+            },
+            upsert=True
+        )
+        for (item, hour), prices in batch.items()
+    ]
+    try:
+        await offers_collection.bulk_write(requests, ordered=False)
+    except Exception as e:
+        logger.error(f"Failed to store {len(requests)} offer buckets: {e}")
+
+
+async def load_offer_history() -> None:
+    """Warm the rolling windows from the most recent buckets."""
+    since = datetime.utcnow() - timedelta(hours=OFFER_WARMUP_HOURS)
+    cursor = offers_collection.find({"hour": {"$gte": since}}, {"_id": 0, "item": 1, "samples": 1}).sort("hour", 1)
+    buckets = 0
+    async for bucket in cursor:
+        buckets += 1
+        for unit_price in bucket.get("samples", []):
+            _observe(bucket["item"], unit_price)
+    logger.info(f"Loaded {buckets} offer buckets; market prices known for {len(reference_prices)} items.")
@@ -1,4 +1,9 @@
+import asyncio
+import hashlib
 import logging
+import os
+import re
+from typing import NamedTuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     CallbackQueryHandler,
@@ -7,27 +12,18 @@ from telegram.ext import (
 )
 
 # from ShinobiCompass.modules.flood import flood_control
+from ShinobiCompass.cache import TTLCache, SingleFlight
+from ShinobiCompass.market import reference_prices, record_post
 from ShinobiCompass.modules.verify import require_verification
+# Shinobi lists live in ShinobiCompass.shinobi; re-exported here for existing imports
+from ShinobiCompass.shinobi import LEGENDARY_SHINOBIS, NON_LEGENDARY_SHINOBIS, match_shinobi
 
 # Configure logging
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     level=logging.INFO,
 )
-
-# Shinobi classifications
-LEGENDARY_SHINOBIS = [
-    "Shisui Uchiha", "Tsunade Senju", "Gaara", "Jiraiya", "Hiruzen Sarutobi",
-    "Orochimaru", "Might Guy", "Kakashi Hatake", "Itachi Uchiha", "Minato Namikaze",
-    "Madara Uchiha", "Hashirama Senju", "Tobirama Senju", "Mu", "Onoki",
-    "Gengetsu Hozuki", "A", "Ay", "Mei Terumi", "Rasa",
-]
-NON_LEGENDARY_SHINOBIS = [
-    "Ino Yamanaka", "Choji Akimichi", "Shikamaru Nara", "Rock Lee", "Neji Hyuga",
-    "Ten Ten", "Sakura Haruno", "Hinata Hyuga", "Kiba Inuzuka", "Shino Aburame",
-    "Kankuro", "Temari", "Asuma", "Konohamaru", "Iruka Umino", "Sai", "Rin Nohara",
-    "Hanabi Hyuga", "Kurenai Yuhi", "Kushina Uzumaki",
-]
+logger = logging.getLogger(__name__)
 
 # Conversion rates and fixed prices
 GEM_TO_COIN = 2000
@@ -39,17 +35,99 @@ RARE_LEVELUP_CARD_TOKENS = 10
 LEGENDARY_AWAKEN_CARD = 120
 NON_LEGENDARY_AWAKEN_CARD = 90
 
-# Helper function to calculate expected price in stocks
-def calculate_expected_price_in_stocks(price_in_tokens):
-    """
-    This function calculates the price in stocks based on the given price in tokens.
-    It divides the price in tokens by the STOCK_TO_TOKEN constant.
-    """
-    return price_in_tokens / STOCK_TO_TOKEN
+# Pricing rules, evaluated in order within a section; the first match wins.
+# `tokens` is the expected price per unit as a (min, max) token range, which is
+# converted to stocks; `units_per_stock` prices the item directly in stocks.
+class PriceRule(NamedTuple):
+    section: str
+    label: str
+    pattern: str  # Case-insensitive regex searched in the item text
+    legendary: bool | None = None  # Awaken cards: only legendary / non-legendary shinobis
+    tokens: tuple[int, int] | None = None
+    units_per_stock: int | None = None
+
+
+PRICE_RULES = [
+    PriceRule("Epic", "Epic Orochimaru", r"orochimaru", tokens=(12000, 12750)),
+    PriceRule("Legendary", "Legendary Awakening Card", r"awakencard", legendary=True,
+              tokens=(LEGENDARY_AWAKEN_CARD, LEGENDARY_AWAKEN_CARD)),
+    PriceRule("Legendary", "Non-Legendary Awakening Card", r"awakencard", legendary=False,
+              tokens=(NON_LEGENDARY_AWAKEN_CARD, NON_LEGENDARY_AWAKEN_CARD)),
+    PriceRule("Rare", "Legendary Levelup Card", r"card.*legendary|legendary.*card",
+              tokens=(RARE_LEVELUP_CARD_TOKENS, RARE_LEVELUP_CARD_TOKENS)),
+    PriceRule("Rare", "Token", r"token", units_per_stock=STOCK_TO_TOKEN),
+    PriceRule("Rare", "Non-Legendary Levelup Card", r"card",
+              tokens=(RARE_LEVELUP_CARD_TOKENS, RARE_LEVELUP_CARD_TOKENS)),
+    PriceRule("Common", "Common Coins", r"coins", units_per_stock=STOCK_TO_COIN),
+    PriceRule("Common", "Common Gems", r"gems", units_per_stock=STOCK_TO_GEM),
+]
+
+# Compiled once: section -> [(compiled pattern, rule)]
+_COMPILED_RULES = {}
+for _rule in PRICE_RULES:
+    _COMPILED_RULES.setdefault(_rule.section, []).append((re.compile(_rule.pattern, re.IGNORECASE), _rule))
+
+_SECTION_RE = re.compile(r"^(Epic|Legendary|Rare|Common):")
+# "<serial>: <quantity> <item ... (<price>)>"; the price is the last parenthesized number
+_LINE_RE = re.compile(r"^[^:]*:\s*(\d+)\s+(.*\((\d+(?:\.\d+)?)\).*)$")
+
+
+def _match_rule(section: str, item: str) -> tuple[PriceRule, str] | None:
+    """Return the matching rule and the canonical item name used for price history."""
+    for pattern, rule in _COMPILED_RULES.get(section, ()):
+        if not pattern.search(item):
+            continue
+        if rule.legendary is None:
+            return rule, rule.label
+        # Cards of unknown shinobis are priced as non-legendary
+        shinobi = match_shinobi(item)
+        if rule.legendary != bool(shinobi and shinobi[1]):
+            continue
+        # Each shinobi's card has its own market price
+        return rule, f"{rule.label}: {shinobi[0]}" if shinobi else rule.label
+    return None
+
+
+def _format_deal(rule: PriceRule, item_key: str, item: str, quantity: int, price: float) -> str | None:
+    """Return the deal report for one offer, or None if it is not below the expected price."""
+    market = reference_prices.get(item_key)
+    if market:
+        # Enough offers seen: a deal is an offer below the low percentile of recent prices
+        threshold, median, samples = market
+        stocks_min = threshold * quantity
+        expected = (
+            f"below {stocks_min:.2f} stocks "
+            f"(market median {median * quantity:.2f} over {samples} offers)"
+        )
+    elif rule.tokens:
+        tokens_min, tokens_max = rule.tokens[0] * quantity, rule.tokens[1] * quantity
+        stocks_min, stocks_max = tokens_min / STOCK_TO_TOKEN, tokens_max / STOCK_TO_TOKEN
+        if tokens_min == tokens_max:
+            expected = f"{stocks_min:.2f} stocks ({tokens_min} tokens)"
+        else:
+            expected = f"{stocks_min:.2f} - {stocks_max:.2f} stocks ({tokens_min} - {tokens_max} tokens)"
+    else:
+        stocks_min = quantity / rule.units_per_stock
+        expected = f"{stocks_min:.2f} stocks"
+
+    if price >= stocks_min:
+        return None
+    return (
+        f"<b>{rule.label}:</b> {item}\n"
+        f"   💸 <b>Offer Price:</b> {price:.2f} stocks\n"
+        f"   📈 <b>Expected Price:</b> {expected}\n\n"
+    )
+
 
 # Analyze the black market message
 def analyze_message(message):
+    return _analyze(message)[0]
+
+
+def _analyze(message: str) -> tuple[list[str], list[tuple[str, int, float]]]:
+    """Return the profitable deal reports and every priced offer as (item, quantity, price)."""
     profit_deals = []
+    offers = []
     lines = message.split("\n")
 
     # Remove the last two lines
@@ -61,126 +139,105 @@ def analyze_message(message):
         line = line.strip()
 
         # Identify section (Epic, Legendary, Rare, Common)
-        if line.startswith(("Epic:", "Legendary:", "Rare:", "Common:")):
-            section = line.split(":")[0]
+        section_match = _SECTION_RE.match(line)
+        if section_match:
+            section = section_match.group(1)
 
         if not section or not line:
             continue
 
-        try:
-            # Remove serial number
-            parts = line.split(":")[1].strip().split()
-            if len(parts) < 2:
-                continue
-
-            # Parse quantity and item
-            quantity = int(parts[0])
-            item = " ".join(parts[1:])
-
-            # Parse price
-            price_str = item.split("(")[-1].split(")")[0]
-            price = float(price_str)
-
-            # Check for Epic section (Orochimaru)
-            if section == "Epic" and "Orochimaru" in item:
-                expected_price_tokens_min = 12000 * quantity
-                expected_price_tokens_max = 12750 * quantity
-                expected_price_stocks_min = calculate_expected_price_in_stocks(expected_price_tokens_min)
-                expected_price_stocks_max = calculate_expected_price_in_stocks(expected_price_tokens_max)
-                if price < expected_price_stocks_min:
-                    profit_deals.append(
-                        f"<b>Epic Orochimaru:</b> {item}\n"
-                        f"   💸 <b>Offer Price:</b> {price:.2f} stocks\n"
-                        f"   📈 <b>Expected Price:</b> {expected_price_stocks_min:.2f} - {expected_price_stocks_max:.2f} stocks "
-                        f"({expected_price_tokens_min} - {expected_price_tokens_max} tokens)\n\n"
-                    )
-
-            # Check for Legendary section (Awakening Cards)
-            elif section == "Legendary" and "awakencard" in item.lower():
-                if any(legendary in item for legendary in LEGENDARY_SHINOBIS):
-                    # Legendary Awakening Cards
-                    expected_price_tokens = quantity * LEGENDARY_AWAKEN_CARD
-                    expected_price_stocks = calculate_expected_price_in_stocks(expected_price_tokens)
-                    if price < expected_price_stocks:
-                        profit_deals.append(
-                            f"<b>Legendary Awakening Card:</b> {item}\n"
-                            f"   💸 <b>Offer Price:</b> {price:.2f} stocks\n"
-                            f"   📈 <b>Expected Price:</b> {expected_price_stocks:.2f} stocks ({expected_price_tokens} tokens)\n\n"
-                        )
-                else:
-                    # Non-Legendary Awakening Cards
-                    expected_price_tokens = quantity * NON_LEGENDARY_AWAKEN_CARD
-                    expected_price_stocks = calculate_expected_price_in_stocks(expected_price_tokens)
-                    if price < expected_price_stocks:
-                        profit_deals.append(
-                            f"<b>Non-Legendary Awakening Card:</b> {item}\n"
-                            f"   💸 <b>Offer Price:</b> {price:.2f} stocks\n"
-                            f"   📈 <b>Expected Price:</b> {expected_price_stocks:.2f} stocks ({expected_price_tokens} tokens)\n\n"
-                        )
-
-            # Check for Rare section (Levelup card)
-            elif section == "Rare" and "card" in item.lower():
-                if "legendary" in item.lower():
-                    # Legendary Levelup Cards
-                    expected_price_tokens = quantity * RARE_LEVELUP_CARD_TOKENS
-                    expected_price_stocks = calculate_expected_price_in_stocks(expected_price_tokens)
-                    if price < expected_price_stocks:
-                        profit_deals.append(
-                            f"<b>Legendary Levelup Card:</b> {item}\n"
-                            f"   💸 <b>Offer Price:</b> {price:.2f} stocks\n"
-                            f"   📈 <b>Expected Price:</b> {expected_price_stocks:.2f} stocks ({expected_price_tokens} tokens)\n\n"
-                        )
-
-                # Check for "Token" section (Token items)
-                elif section == "Rare" and "token" in item.lower():
-                    expected_price_tokens = calculate_expected_price_in_tokens(price)
-                    if price < expected_price_stocks:
-                        profit_deals.append(
-                            f"<b>Token:</b> {item}\n"
-                            f"   💸 <b>Offer Price:</b> {price:.2f} tokens\n"
-                            f"   📈 <b>Expected Price:</b> {expected_price_tokens:.2f} tokens\n\n"
-
-                        )
-                        
-                else:
-                    # Non-Legendary Levelup Cards
-                    expected_price_tokens = quantity * RARE_LEVELUP_CARD_TOKENS
-                    expected_price_stocks = calculate_expected_price_in_stocks(expected_price_tokens)
-                    if price < expected_price_stocks:
-                        profit_deals.append(
-                            f"<b>Non-Legendary Levelup Card:</b> {item}\n"
-                            f"   💸 <b>Offer Price:</b> {price:.2f} stocks\n"
-                            f"   📈 <b>Expected Price:</b> {expected_price_stocks:.2f} stocks ({expected_price_tokens} tokens)\n\n"
-                        )
-
-
-
-
-
-            # Check for Common section (Coins and Gems)
-            elif section == "Common":
-                if "coins" in item.lower():
-                    expected_price_stocks = quantity / STOCK_TO_COIN
-                    if price < expected_price_stocks:
-                        profit_deals.append(
-                            f"<b>Common Coins:</b> {item}\n"
-                            f"   💸 <b>Offer Price:</b> {price:.2f} stocks\n"
-                            f"   📈 <b>Expected Price:</b> {expected_price_stocks:.2f} stocks\n\n"
-                        )
-                elif "gems" in item.lower():
-                    expected_price_stocks = quantity / STOCK_TO_GEM
-                    if price < expected_price_stocks:
-                        profit_deals.append(
-                            f"<b>Common Gems:</b> {item}\n"
-                            f"   💸 <b>Offer Price:</b> {price:.2f} stocks\n"
-                            f"   📈 <b>Expected Price:</b> {expected_price_stocks:.2f} stocks\n\n"
-                        )
-
-        except Exception as e:
-            logging.error(f"Error processing line '{line}': {e}")
+        # Parse quantity, item and price in one go; anything else is not an offer
+        offer = _LINE_RE.match(line)
+        if not offer:
             continue
+        quantity = int(offer.group(1))
+        item = offer.group(2)
+        price = float(offer.group(3))
+
+        matched = _match_rule(section, item)
+        if matched:
+            rule, item_key = matched
+            offers.append((item_key, quantity, price))
+            deal = _format_deal(rule, item_key, item, quantity, price)
+            if deal:
+                profit_deals.append(deal)
+
+    return profit_deals, offers
+
+
+# Rendered reports by message content: the same post is forwarded into many
+# groups within seconds, so it is analyzed once and served from here after
+BM_CACHE_SIZE = int(os.getenv("BM_CACHE_SIZE", "1000"))
+BM_CACHE_TTL = int(os.getenv("BM_CACHE_TTL", "300"))  # seconds
+report_cache = TTLCache(maxsize=BM_CACHE_SIZE, ttl=BM_CACHE_TTL)
+report_flights = SingleFlight()
+_NO_DEALS = ""
+
 
-    return profit_deals
+def _normalize(message: str) -> str:
+    # Whitespace around a line does not change the analysis; the line count does
+    return "\n".join(line.strip() for line in message.split("\n"))
+
+
+def render_report(message: str) -> tuple[str, list]:
+    """Return the HTML deal report for a message (empty if nothing is profitable) and its offers."""
+    profit_deals, offers = _analyze(message)
+    if not profit_deals:
+        return _NO_DEALS, offers
+    return "💎 <b>Profitable Deals Found</b>:\n\n" + "".join(profit_deals), offers
+
+
+async def get_report(message: str) -> str:
+    """Cached render_report(); concurrent requests for the same post share one analysis."""
+    message = _normalize(message)
+    key = hashlib.blake2b(message.encode(), digest_size=16).digest()
+    report = report_cache.get(key)
+    if report is not None:
+        return report
+
+    async def compute():
+        report, offers = await asyncio.to_thread(render_report, message)
+        # Forwarded copies must not skew the price history: the post's hash is
+        # stored, and only the first replica to store it records the offers
+        await record_post(key.hex(), offers)
+        report_cache.set(key, report)
+        return report
+
+    return await report_flights.do(key, compute)
+
+
+def report_stats() -> dict:
+    return {**report_cache.stats(), "shared": report_flights.shared}
+
+
+_BLACK_MARKET_RE = re.compile(r"black market", re.IGNORECASE)
+
+# Only accept black market posts sent or forwarded by a bot (the game bot)
+BM_BOT_SENDERS_ONLY = os.getenv("BM_BOT_SENDERS_ONLY", "false").lower() in ("1", "true", "yes")
+
+
+def is_black_market_text(text: str | None) -> bool:
+    return bool(text) and _BLACK_MARKET_RE.search(text) is not None
+
+
+class BlackMarketFilter(filters.MessageFilter):
+    """Pass only messages whose text or caption contains the black market header.
+
+    Runs inside the dispatcher, so the rest of the group traffic never gets a
+    handler coroutine scheduled for it.
+    """
+
+    def filter(self, message) -> bool:
+        # Media without a caption has nothing to analyze
+        if not is_black_market_text(message.text or message.caption):
+            return False
+        if BM_BOT_SENDERS_ONLY:
+            sender = message.forward_from or message.from_user
+            return sender is not None and sender.is_bot
+        return True
+
+
+black_market_filter = BlackMarketFilter(name="black_market_filter")
 
 
 # Command: /bm (manual analysis)
@@ -190,16 +247,16 @@ async def bm(update: Update, _: CallbackContext) -> None:
     if update.message.reply_to_message:
         # Get the replied message content
         message = update.message.reply_to_message.text or update.message.reply_to_message.caption
-        if not message or "BLACK MARKET" not in message.upper():
+        if not is_black_market_text(message):
             await update.message.reply_text("⚠️ This is not a valid black market message.")
             return
 
         sent_message = await update.message.reply_text("🔍 Analyzing...")
-        profit_deals = analyze_message(message)
+        report = await get_report(message)
 
-        if profit_deals:
+        if report:
             await sent_message.edit_text(
-                "💎 <b>Profitable Deals Found</b>:\n\n" + "".join(profit_deals) + "\n<b>Note: Bot only analyzes Shinobi card trade profit.</b>",
+                report + "\n<b>Note: Bot only analyzes Shinobi card trade profit.</b>",
                 parse_mode="HTML"
             )
         else:
@@ -207,23 +264,18 @@ async def bm(update: Update, _: CallbackContext) -> None:
     else:
         await update.message.reply_text("⚠️ Please reply to a valid black market message.")
 
-# Automatic analysis
+# Automatic analysis; register with black_market_filter so only black market posts get here
 async def handle_message(update: Update, _: CallbackContext) -> None:
     if not update.message:
         return
 
     message = update.message.text or update.message.caption
-    if hasattr(update.message, 'forward_from') or hasattr(update.message, 'forward_from_chat'):
-        message = update.message.text or update.message.caption
-    logging.info(f"Received message: {message}")  # Log the message received
-    if "BLACK MARKET" in (message or "").upper():  # Ensure the condition is met
+    logger.debug(f"Black market post in chat {update.message.chat_id} ({len(message or '')} chars)")
+    if is_black_market_text(message):
         sent_message = await update.message.reply_text("🔍 Analyzing...")
-        profit_deals = analyze_message(message)
+        report = await get_report(message)
 
-        if profit_deals:
-            await sent_message.edit_text(
-                "💎 <b>Profitable Deals Found</b>:\n\n" + "".join(profit_deals),
-                parse_mode="HTML"
-            )
+        if report:
+            await sent_message.edit_text(report, parse_mode="HTML")
         else:
             await sent_message.edit_text("🔍 No profitable deals found.", parse_mode="HTML")
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateMany
+from telegram import Update
+from telegram.error import Forbidden
+from telegram.ext import ContextTypes
+
+from ShinobiCompass.background import cancel_and_wait
+from ShinobiCompass.database import db
+from ShinobiCompass.modules.sudo import is_owner_or_sudo
+from ShinobiCompass.outbox import outbox, BULK, INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+# One document per broadcast: what to send, progress checkpoint and totals
+broadcasts_collection = db["broadcasts"]
+users_collection = db["users"]
+
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))  # Recipients per checkpoint
+# A broadcast belongs to the replica holding its lease. The lease is renewed
+# at every checkpoint; one that expired belongs to a replica that died.
+BROADCAST_LEASE = timedelta(seconds=int(os.getenv("BROADCAST_LEASE_SECONDS", "120")))
+BROADCAST_RESUME_INTERVAL = BROADCAST_LEASE.total_seconds() / 2  # seconds between looks for orphaned broadcasts
+
+# Identifies this process as a lease owner
+INSTANCE_ID = uuid.uuid4().hex
+
+# Broadcasts running in this process: broadcast _id -> task
+_running = {}
+
+
+def _start(broadcast_id: ObjectId) -> None:
+    if broadcast_id in _running:
+        return
+    # Plain asyncio task: Application.stop() would otherwise wait for the whole broadcast
+    task = asyncio.create_task(_run_broadcast(broadcast_id))
+    _running[broadcast_id] = task
+    task.add_done_callback(lambda _: _running.pop(broadcast_id, None))
+
+
+async def _claim(broadcast_id: ObjectId) -> dict | None:
+    """Take or renew the lease on a running broadcast; None if another replica holds it."""
+    now = datetime.utcnow()
+    return await broadcasts_collection.find_one_and_update(
+        {
+            "_id": broadcast_id,
+            "status": "running",
+            "$or": [{"owner": INSTANCE_ID}, {"lease_until": {"$lt": now}}, {"lease_until": None}],
+        },
+        {"$set": {"owner": INSTANCE_ID, "lease_until": now + BROADCAST_LEASE}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _deliver(broadcast: dict, user_id: int):
+    """Send the broadcast to one user through the outbox's bulk lane."""
+    if "text" in broadcast:
+        return await outbox.send_message(user_id, broadcast["text"], priority=BULK, parse_mode="HTML")
+    return await outbox.call(
+        user_id, "copy_message", priority=BULK,
+        from_chat_id=broadcast["from_chat_id"], message_id=broadcast["message_id"]
+    )
+
+
+async def _send_batch(broadcast: dict, user_ids: list[int]) -> bool:
+    """Send one batch concurrently, then record the outcome and checkpoint in bulk.
+
+    Returns False if the broadcast should stop: it was canceled or this
+    replica lost its lease.
+    """
+    results = await asyncio.gather(*(_deliver(broadcast, user_id) for user_id in user_ids), return_exceptions=True)
+
+    delivered, blocked = [], []
+    failed = 0
+    for user_id, result in zip(user_ids, results):
+        if isinstance(result, Forbidden):
+            blocked.append(user_id)  # The user blocked the bot or deleted the account
+        elif isinstance(result, Exception):
+            failed += 1
+            logger.debug(f"Broadcast to {user_id} failed: {result}")
+        else:
+            delivered.append(user_id)
+
+    requests = []
+    if delivered:
+        requests.append(UpdateMany({"user_id": {"$in": delivered}}, {"$set": {"blocked": False}}))
+    if blocked:
+        requests.append(UpdateMany({"user_id": {"$in": blocked}}, {"$set": {"blocked": True}}))
+    if requests:
+        await users_collection.bulk_write(requests, ordered=False)
+
+    # Checkpoint and renew the lease in one write
+    now = datetime.utcnow()
+    result = await broadcasts_collection.update_one(
+        {"_id": broadcast["_id"], "owner": INSTANCE_ID, "status": "running"},
+        {
+            "$set": {"checkpoint": user_ids[-1], "updated_at": now, "lease_until": now + BROADCAST_LEASE},
+            "$inc": {"delivered": len(delivered), "blocked": len(blocked), "failed": failed},
+        }
+    )
+    return result.modified_count == 1
+
+
+async def _run_broadcast(broadcast_id: ObjectId) -> None:
+    broadcast = await _claim(broadcast_id)
+    if not broadcast:
+        return
+
+    # Stream recipients after the checkpoint in user_id order, so a restart
+    # resumes with the first user not yet recorded
+    query = {}
+    if broadcast.get("checkpoint") is not None:
+        query["user_id"] = {"$gt": broadcast["checkpoint"]}
+    cursor = users_collection.find(query, {"_id": 0, "user_id": 1}) \
+        .sort("user_id", 1).batch_size(BROADCAST_BATCH_SIZE)
+
+    try:
+        batch = []
+        async for user in cursor:
+            batch.append(user["user_id"])
+            if len(batch) < BROADCAST_BATCH_SIZE:
+                continue
+
+            # Stop between batches if the broadcast was canceled or taken over
+            if not await _send_batch(broadcast, batch):
+                return
+            batch = []
+        if batch and not await _send_batch(broadcast, batch):
+            return
+    except asyncio.CancelledError:
+        raise  # Shutdown; stop_broadcasts() releases the lease for the next start
+    except Exception as e:
+        logger.error(f"Broadcast {broadcast_id} stopped: {e}", exc_info=True)
+        return
+    finally:
+        await cursor.close()
+
+    broadcast = await broadcasts_collection.find_one_and_update(
+        {"_id": broadcast_id, "owner": INSTANCE_ID},
+        {"$set": {"status": "done", "finished_at": datetime.utcnow()}, "$unset": {"lease_until": ""}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not broadcast:
+        return
+    await outbox.send_message(
+        broadcast["chat_id"],
+        f"<b>📣 Broadcast Finished</b>\n\n"
+        f"┣ <b>Delivered:</b> {broadcast.get('delivered', 0)}\n"
+        f"┣ <b>Blocked:</b> {broadcast.get('blocked', 0)}\n"
+        f"┗ <b>Failed:</b> {broadcast.get('failed', 0)}",
+        priority=INTERACTIVE, wait=False, parse_mode="HTML"
+    )
+
+
+async def resume_broadcasts() -> None:
+    """Resume running broadcasts whose lease expired (their replica stopped or died).
+
+    Called at startup and periodically; _run_broadcast() claims the lease, so
+    each broadcast is resumed by exactly one replica.
+    """
+    query = {"status": "running", "$or": [{"lease_until": {"$lt": datetime.utcnow()}}, {"lease_until": None}]}
+    async for broadcast in broadcasts_collection.find(query, {"_id": 1, "checkpoint": 1}):
+        if broadcast["_id"] in _running:
+            continue
+        logger.info(f"Resuming broadcast {broadcast['_id']} after user {broadcast.get('checkpoint')}.")
+        _start(broadcast["_id"])
+
+
+async def stop_broadcasts() -> None:
+    """Cancel this process's broadcasts and release their leases so a restart resumes them at once."""
+    broadcast_ids = list(_running)
+    await cancel_and_wait(list(_running.values()))
+    if broadcast_ids:
+        await broadcasts_collection.update_many(
+            {"_id": {"$in": broadcast_ids}, "owner": INSTANCE_ID},
+            {"$set": {"lease_until": None}}
+        )
+
+
+# Command to send a message to every user: /broadcast <message>, or reply to a message
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_owner_or_sudo(update):
+        await update.message.reply_text("<b>⚠ You must be the owner or a sudo user to use this command.</b>", parse_mode="HTML")
+        return
+
+    # /broadcast stop cancels the running broadcasts
+    if context.args and context.args[0].lower() == "stop":
+        result = await broadcasts_collection.update_many({"status": "running"}, {"$set": {"status": "canceled"}})
+        await update.message.reply_text(f"<b>🛑 Canceled {result.modified_count} broadcast(s).</b>", parse_mode="HTML")
+        return
+
+    doc = {
+        "status": "running",
+        "checkpoint": None,
+        "delivered": 0,
+        "blocked": 0,
+        "failed": 0,
+        "chat_id": update.effective_chat.id,
+        "owner": INSTANCE_ID,
+        "lease_until": datetime.utcnow() + BROADCAST_LEASE,
+        "created_by": update.effective_user.id,
+        "created_at": datetime.utcnow(),
+    }
+    if update.message.reply_to_message:
+        doc["from_chat_id"] = update.message.chat_id
+        doc["message_id"] = update.message.reply_to_message.message_id
+    elif context.args:
+        doc["text"] = update.message.text_html.split(None, 1)[1]
+    else:
+        await update.message.reply_text("Usage: /broadcast <message>, or reply to a message with /broadcast")
+        return
+
+    result = await broadcasts_collection.insert_one(doc)
+    _start(result.inserted_id)
+    await update.message.reply_text(
+        "<b>📣 Broadcast started.</b>\nYou will get a summary when it finishes. Use /broadcast stop to cancel.",
+        parse_mode="HTML"
+    )
@@ -1,4 +1,5 @@
 from ShinobiCompass.modules.sudo import is_owner_or_sudo
+from ShinobiCompass.outbox import outbox
 from telegram import Update
 from telegram.ext import ContextTypes, CallbackContext
 
@@ -26,7 +27,7 @@ async def reply(update: Update, context: CallbackContext) -> None:
 
     # Attempt to send the message
     try:
-        await context.bot.send_message(chat_id=user_id, text=reply_message)
+        await outbox.send_message(chat_id=user_id, text=reply_message)
         await update.message.reply_text('Your reply has been sent.')
     except Exception as e:
         await update.message.reply_text(f'Failed to send message: {e}')
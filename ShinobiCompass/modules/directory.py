@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from pymongo import UpdateOne
+from telegram import Bot, Update
+from telegram.ext import CallbackContext
+from ShinobiCompass.cache import TTLCache
+from ShinobiCompass.database import db
+
+logger = logging.getLogger(__name__)
+
+NAME_CACHE_SIZE = int(os.getenv("NAME_CACHE_SIZE", "50000"))
+NAME_CACHE_TTL = 7 * 24 * 60 * 60  # A week; refreshed whenever the user talks to the bot
+NAME_RESOLVE_CONCURRENCY = 10  # Parallel get_chat_member calls
+NAME_RESOLVE_TIMEOUT = 5  # Seconds to wait for Telegram before falling back
+DIRECTORY_FLUSH_INTERVAL = int(os.getenv("DIRECTORY_FLUSH_INTERVAL", "10"))  # seconds
+LAST_SEEN_RESOLUTION = 60 * 60  # Re-persist an unchanged user at most once an hour
+
+# Persistent directory: {_id: user_id, first_name, username, last_seen}
+directory_collection = db["user_directory"]
+
+# Users seen on incoming updates: user_id -> (first_name, username, last written)
+display_names = TTLCache(maxsize=NAME_CACHE_SIZE, ttl=NAME_CACHE_TTL)
+
+# Directory writes waiting for the next flush, coalesced per user
+_pending_writes: dict[int, dict] = {}
+
+
+def _remember(user_id: int, first_name: str, username: str | None) -> None:
+    now = time.time()
+    entry = display_names.get(user_id)
+    if entry is not None and entry[:2] == (first_name, username) and now - entry[2] < LAST_SEEN_RESOLUTION:
+        return  # Nothing new to persist
+
+    display_names.set(user_id, (first_name, username, now))
+    _pending_writes[user_id] = {
+        "first_name": first_name,
+        "username": username,
+        "last_seen": datetime.utcfromtimestamp(now),
+    }
+
+
+# Pre-handler: register with TypeHandler(Update, remember_user) ahead of the
+# other handlers so every update refreshes the sender's directory entry.
+async def remember_user(update: Update, context: CallbackContext) -> None:
+    user = update.effective_user
+    if user and not user.is_bot:
+        _remember(user.id, user.first_name, user.username)
+
+
+async def flush_directory() -> None:
+    """Write the coalesced directory updates in one unordered bulk write."""
+    global _pending_writes
+    if not _pending_writes:
+        return
+
+    batch, _pending_writes = _pending_writes, {}
+    requests = [
+        UpdateOne({"_id": user_id}, {"$set": fields}, upsert=True)
+        for user_id, fields in batch.items()
+    ]
+    try:
+        await directory_collection.bulk_write(requests, ordered=False)
+    except Exception as e:
+        logger.error(f"Failed to flush {len(requests)} directory entries: {e}")
+
+
+async def lookup_names(user_ids: list[int]) -> dict[int, str]:
+    """Batch lookup of display names from memory, then from the directory.
+
+    Users the bot has never seen are left out of the result.
+    """
+    names = {}
+    missing = []
+    for user_id in user_ids:
+        entry = display_names.get(user_id)
+        if entry is not None:
+            names[user_id] = entry[0]
+        else:
+            missing.append(user_id)
+
+    if missing:
+        cursor = directory_collection.find({"_id": {"$in": missing}}, {"first_name": 1, "username": 1})
+        async for doc in cursor:
+            names[doc["_id"]] = doc["first_name"]
+            # Warm the cache without scheduling a write
+            display_names.set(doc["_id"], (doc["first_name"], doc.get("username"), time.time()))
+    return names
+
+
+async def resolve_names(bot: Bot, chat_id: int, user_ids: list[int], timeout: float = NAME_RESOLVE_TIMEOUT) -> dict[int, str]:
+    """Return {user_id: first_name} for the given users.
+
+    Names come from the directory first. The rest are fetched with
+    get_chat_member, NAME_RESOLVE_CONCURRENCY at a time, and whatever has not
+    answered within `timeout` seconds in total falls back to the user ID, so
+    the time spent does not grow with the number of users.
+    """
+    names = await lookup_names(user_ids)
+    missing = [user_id for user_id in user_ids if user_id not in names]
+
+    if missing:
+        semaphore = asyncio.Semaphore(NAME_RESOLVE_CONCURRENCY)
+
+        async def fetch(user_id: int) -> None:
+            async with semaphore:
+                member = await bot.get_chat_member(chat_id, user_id)
+            names[user_id] = member.user.first_name
+            _remember(user_id, member.user.first_name, member.user.username)
+
+        tasks = [asyncio.create_task(fetch(user_id)) for user_id in missing]
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            if task.exception() is not None:
+                logger.debug(f"Could not resolve a name in chat {chat_id}: {task.exception()}")
+
+    for user_id in user_ids:
+        names.setdefault(user_id, str(user_id))
+    return names
@@ -1,100 +1,353 @@
-from datetime import datetime, timedelta
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 from telegram import Update
-from telegram.ext import CommandHandler, CallbackContext
+from telegram.ext import ApplicationHandlerStop, CommandHandler, CallbackContext
+from pymongo import ReturnDocument
 from ShinobiCompass.database import db
 from ShinobiCompass.modules.sudo import is_owner_or_sudo
 
+logger = logging.getLogger(__name__)
+
 # Constants (Initial Values)
 COOLDOWN = 3  # Minimum time between commands (in seconds)
 SPAM_THRESHOLD = 5  # Maximum allowed commands in SPAM_TIME_FRAME
 SPAM_TIME_FRAME = 10  # Time frame to detect spamming (in seconds)
 WARN_LIMIT = 3  # Maximum warnings before escalating penalties
 PAUSE_DURATIONS = [30 * 60, 60 * 60, 24 * 60 * 60]  # Penalty durations: 30 mins, 1 hr, 1 day
+IDLE_STATE_TTL = 24 * 60 * 60  # Forget idle, unblocked users after a day (also the TTL of stored state)
+
+# "local" keeps the windows in this process; "distributed" makes MongoDB the
+# single source of truth so several replicas enforce the same limits.
+FLOOD_MODE = os.getenv("FLOOD_MODE", "local").lower()
+FLOOD_CONSTANTS_REFRESH_INTERVAL = int(os.getenv("FLOOD_CONSTANTS_REFRESH_INTERVAL", "30"))  # seconds
 
 # MongoDB collections
-users_collection = db["users"]  # Collection to store user activity
+# Flood state lives apart from the user profiles, keyed by user ID. The
+# `expires_at` TTL index lets MongoDB drop entries of idle users by itself.
+rate_state_collection = db["rate_state"]
+users_collection = db["users"]
+settings_collection = db["settings"]  # Central flood constants shared by all replicas
 
-def flood_control(func):
-    @wraps(func)
-    async def wrapper(update, context):
-        user_id = update.effective_user.id
-        current_time = datetime.utcnow()
-
-        # Fetch or initialize user data
-        user_data = users_collection.find_one({"user_id": user_id})
-        if not user_data:
-            user_data = {
-                "user_id": user_id,
-                "activity": [],
-                "warnings": 0,
-                "block_end_time": None
-            }
-            users_collection.insert_one(user_data)
+# Mapping of /set names to the module constants they control
+CONSTANT_NAMES = {
+    "cooldown": "COOLDOWN",
+    "spam_threshold": "SPAM_THRESHOLD",
+    "spam_time_frame": "SPAM_TIME_FRAME",
+    "warn_limit": "WARN_LIMIT",
+    "pause_durations": "PAUSE_DURATIONS",
+}
+_constants_version = None
+
+
+def _is_valid_constant(name: str, value) -> bool:
+    """Every constant must be at least 1; pause_durations needs at least one duration."""
+    if name == "pause_durations":
+        return isinstance(value, list) and bool(value) and all(isinstance(v, int) and v >= 1 for v in value)
+    return isinstance(value, int) and value >= 1
+
+
+def _apply_constants(doc: dict) -> None:
+    global _constants_version
+    for field, constant in CONSTANT_NAMES.items():
+        if field in doc:
+            # A bad stored value must not break the guard that runs on every update
+            if not _is_valid_constant(field, doc[field]):
+                logger.error(f"Ignoring invalid flood constant {field}={doc[field]!r}")
+                continue
+            globals()[constant] = doc[field]
+    _constants_version = doc.get("version", 0)
+
+
+async def load_flood_constants() -> None:
+    """Load the central flood constants into this process."""
+    doc = await settings_collection.find_one({"_id": "flood_constants"})
+    if doc:
+        _apply_constants(doc)
+
+
+async def refresh_flood_constants() -> None:
+    """Reload the constants only when another replica changed them."""
+    doc = await settings_collection.find_one({"_id": "flood_constants"}, {"version": 1})
+    if doc and doc.get("version", 0) != _constants_version:
+        await load_flood_constants()
+
+
+async def store_flood_constant(name: str, value) -> None:
+    """Persist a constant centrally, bump the version and apply it locally.
+
+    Raises ValueError for values the flood guard cannot work with.
+    """
+    if not _is_valid_constant(name, value):
+        raise ValueError(f"Invalid value for {name}: {value!r}")
+    doc = await settings_collection.find_one_and_update(
+        {"_id": "flood_constants"},
+        {"$set": {name: value}, "$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    _apply_constants(doc)
+
+
+class _RateState:
+    """Sliding window and penalty state of a single user."""
+
+    __slots__ = ("activity", "warnings", "block_end_time")
+
+    def __init__(self):
+        self.activity = deque(maxlen=SPAM_THRESHOLD)  # Timestamps of the last commands
+        self.warnings = 0
+        self.block_end_time = 0.0
+
+
+class FloodControl:
+    """In-memory flood control engine.
+
+    Each user keeps a ring buffer of their last SPAM_THRESHOLD command
+    timestamps, so the spam decision is a single comparison against the
+    oldest entry. Only warnings and blocks are written to MongoDB, in the
+    background.
+    """
+
+    def __init__(self):
+        self._states: dict[int, _RateState] = {}
+        self._pending_writes = set()
+
+    def check(self, user_id: int, now: float | None = None) -> tuple[bool, str | None]:
+        """Record a command and decide whether it may run.
+
+        Returns (allowed, notice) where notice is the text to reply with, if any.
+        """
+        now = time.time() if now is None else now
+        state = self._states.get(user_id)
+        if state is None:
+            state = self._states[user_id] = _RateState()
 
         # Check if the user is blocked
-        if user_data["end_time"]:
-            block_end_time = user_data["end_time"]
-            if current_time < block_end_time:
-                remaining_time = int((block_end_time - current_time).total_seconds())
-                await update.message.reply_text(
-                    f"🚫 You are temporarily paused. Try again after {remaining_time} seconds."
-                )
-                return  # Ignore the command during the block time
-            else:
-                # Unblock user after block period expires
-                users_collection.update_one(
-                    {"user_id": user_id},
-                    {"$set": {"block_end_time": None, "warnings": 0}}
-                )
-
-        # Filter activity timestamps within the SPAM_TIME_FRAME
-        recent_activity = [
-            timestamp for timestamp in user_data["activity"]
-            if timestamp >= current_time - timedelta(seconds=SPAM_TIME_FRAME)
+        if state.block_end_time:
+            if now < state.block_end_time:
+                remaining_time = int(state.block_end_time - now)
+                return False, f"🚫 You are temporarily paused. Try again after {remaining_time} seconds."
+            # Unblock user after block period expires
+            state.block_end_time = 0.0
+            state.warnings = 0
+            self._persist(user_id, {"block_end_time": None, "warnings": 0})
+
+        # The window size follows SPAM_THRESHOLD if it was changed with /set
+        if state.activity.maxlen != SPAM_THRESHOLD:
+            state.activity = deque(state.activity, maxlen=SPAM_THRESHOLD)
+        state.activity.append(now)
+
+        # Spamming if the oldest of the last SPAM_THRESHOLD commands is inside the frame
+        if len(state.activity) < SPAM_THRESHOLD or state.activity[0] < now - SPAM_TIME_FRAME:
+            return True, None
+
+        state.warnings += 1
+        if state.warnings <= WARN_LIMIT:
+            self._persist(user_id, {"warnings": state.warnings})
+            return True, f"⚠️ Warning {state.warnings}/{WARN_LIMIT}: Stop spamming!"
+
+        # Temporarily block the user with increasing durations
+        penalty_index = state.warnings - WARN_LIMIT - 1
+        pause_duration = PAUSE_DURATIONS[min(penalty_index, len(PAUSE_DURATIONS) - 1)]
+        state.block_end_time = now + pause_duration
+        self._persist(user_id, {
+            "warnings": state.warnings,
+            "block_end_time": datetime.utcfromtimestamp(state.block_end_time),
+        })
+        return False, f"🚫 You are temporarily blocked for {pause_duration // 60} minutes."
+
+    def _persist(self, user_id: int, fields: dict) -> None:
+        """Write penalty changes without blocking the command."""
+        task = asyncio.create_task(self._write(user_id, fields))
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+
+    async def _write(self, user_id: int, fields: dict) -> None:
+        expires_at = datetime.utcnow() + timedelta(seconds=IDLE_STATE_TTL)
+        if fields.get("block_end_time"):
+            expires_at = max(expires_at, fields["block_end_time"])
+        try:
+            await rate_state_collection.update_one(
+                {"_id": user_id},
+                {"$set": {**fields, "expires_at": expires_at}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to persist flood state for user {user_id}: {e}")
+
+    async def load_blocks(self) -> None:
+        """Restore blocks that are still running from MongoDB."""
+        cursor = rate_state_collection.find(
+            {"block_end_time": {"$gt": datetime.utcnow()}},
+            {"warnings": 1, "block_end_time": 1}
+        )
+        async for doc in cursor:
+            state = self._states.setdefault(doc["_id"], _RateState())
+            state.warnings = doc.get("warnings", 0)
+            state.block_end_time = doc["block_end_time"].replace(tzinfo=timezone.utc).timestamp()
+
+    async def prune(self) -> None:
+        """Drop state of users that have been idle and are not blocked."""
+        now = time.time()
+        idle = [
+            user_id for user_id, state in self._states.items()
+            if state.block_end_time < now
+            and (not state.activity or state.activity[-1] < now - IDLE_STATE_TTL)
         ]
+        for user_id in idle:
+            del self._states[user_id]
 
-          # Block further commands within the cooldown period
+    async def check_distributed(self, user_id: int) -> tuple[bool, str | None]:
+        """Cluster-wide variant of `check`.
 
-        # Update activity log
-        recent_activity.append(current_time)
-        users_collection.update_one(
-            {"user_id": user_id},
-            {"$set": {"activity": recent_activity}}
+        The window update and the spam/penalty decision are evaluated by one
+        pipeline update on the server, so concurrent commands hitting
+        different replicas cannot race each other.
+        """
+        now = datetime.utcnow()
+        window_start = now - timedelta(seconds=SPAM_TIME_FRAME)
+        blocked = {"$gt": [{"$ifNull": ["$block_end_time", None]}, now]}
+        pipeline = [
+            # Lift expired blocks
+            {"$set": {
+                "warnings": {"$cond": [
+                    {"$and": [{"$ne": [{"$ifNull": ["$block_end_time", None]}, None]}, {"$not": [blocked]}]},
+                    0, {"$ifNull": ["$warnings", 0]}
+                ]},
+                "block_end_time": {"$cond": [blocked, "$block_end_time", None]},
+            }},
+            # Slide the window (blocked users' commands are not recorded)
+            {"$set": {
+                "activity": {"$cond": [
+                    blocked,
+                    {"$ifNull": ["$activity", []]},
+                    {"$slice": [{"$concatArrays": [{"$ifNull": ["$activity", []]}, [now]]}, -SPAM_THRESHOLD]},
+                ]},
+            }},
+            {"$set": {
+                "flood_spam": {"$and": [
+                    {"$not": [blocked]},
+                    {"$gte": [{"$size": "$activity"}, SPAM_THRESHOLD]},
+                    {"$gte": [{"$arrayElemAt": ["$activity", 0]}, window_start]},
+                ]},
+            }},
+            {"$set": {"warnings": {"$cond": ["$flood_spam", {"$add": ["$warnings", 1]}, "$warnings"]}}},
+            # Escalate to a block once the warnings run out
+            {"$set": {
+                "block_end_time": {"$cond": [
+                    {"$and": ["$flood_spam", {"$gt": ["$warnings", WARN_LIMIT]}]},
+                    {"$add": [now, {"$multiply": [1000, {"$arrayElemAt": [
+                        PAUSE_DURATIONS,
+                        {"$min": [{"$subtract": ["$warnings", WARN_LIMIT + 1]}, len(PAUSE_DURATIONS) - 1]},
+                    ]}]}]},
+                    "$block_end_time",
+                ]},
+            }},
+            {"$set": {"expires_at": {"$max": [now + timedelta(seconds=IDLE_STATE_TTL), "$block_end_time"]}}},
+        ]
+        doc = await rate_state_collection.find_one_and_update(
+            {"_id": user_id},
+            pipeline,
+            projection={"warnings": 1, "block_end_time": 1, "flood_spam": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
 
-        # Check for spamming
-        if len(recent_activity) >= SPAM_THRESHOLD:
-            warnings = user_data["warnings"] + 1
-            if warnings <= WARN_LIMIT:
-                users_collection.update_one(
-                    {"user_id": user_id},
-                    {"$set": {"warnings": warnings}}
-                )
-                await update.message.reply_text(
-                    f"⚠️ Warning {warnings}/{WARN_LIMIT}: Stop spamming!"
-                )
-            else:
-                # Temporarily block the user with increasing durations
-                penalty_index = warnings - WARN_LIMIT - 1
-                pause_duration = PAUSE_DURATIONS[min(penalty_index, len(PAUSE_DURATIONS) - 1)]
-                block_end_time = current_time + timedelta(seconds=pause_duration)
-
-                users_collection.update_one(
-                    {"user_id": user_id},
-                    {"$set": {"block_end_time": block_end_time}}
-                )
-
-                await update.message.reply_text(
-                    f"🚫 You are temporarily blocked for {pause_duration // 60} minutes."
-                )
-                return  # Block further commands until the pause is over
-
-        # Execute the command after the cooldown and spamming checks
+        block_end_time = doc.get("block_end_time")
+        if block_end_time and block_end_time > now:
+            if doc.get("flood_spam"):
+                pause_duration = int((block_end_time - now).total_seconds())
+                return False, f"🚫 You are temporarily blocked for {pause_duration // 60} minutes."
+            remaining_time = int((block_end_time - now).total_seconds())
+            return False, f"🚫 You are temporarily paused. Try again after {remaining_time} seconds."
+        if doc.get("flood_spam"):
+            return True, f"⚠️ Warning {doc['warnings']}/{WARN_LIMIT}: Stop spamming!"
+        return True, None
+
+
+flood_engine = FloodControl()
+
+
+async def migrate_legacy_rate_state() -> None:
+    """Strip flood fields that older versions stored on the user profiles."""
+    marker = await settings_collection.find_one({"_id": "migrations"}, {"rate_state_split": 1})
+    if marker and marker.get("rate_state_split"):
+        return
+
+    result = await users_collection.update_many(
+        {"$or": [{"activity": {"$exists": True}}, {"block_end_time": {"$exists": True}}]},
+        {"$unset": {"activity": "", "warnings": "", "block_end_time": "", "flood_spam": ""}}
+    )
+    await settings_collection.update_one({"_id": "migrations"}, {"$set": {"rate_state_split": True}}, upsert=True)
+    logger.info(f"Moved flood state off {result.modified_count} user profiles.")
+
+
+async def _apply_flood_control(update: Update) -> bool:
+    """Run the engine for an update; returns False if it must be dropped."""
+    user = update.effective_user
+    if not user or is_owner_or_sudo(user.id):
+        return True
+
+    if FLOOD_MODE == "distributed":
+        allowed, notice = await flood_engine.check_distributed(user.id)
+    else:
+        allowed, notice = flood_engine.check(user.id)
+    if notice and update.effective_message:
+        await update.effective_message.reply_text(notice)
+    return allowed
+
+
+def flood_control(func):
+    @wraps(func)
+    async def wrapper(update, context):
+        if not await _apply_flood_control(update):
+            return  # Ignore the command during the block time
+
+        # Execute the command after the spamming checks
         await func(update, context)
 
     return wrapper
 
+
+# Commands registered with this bot's CommandHandlers, collected on first use
+_own_commands = None
+
+
+def _is_own_command(text: str, context: CallbackContext) -> bool:
+    """True if `text` is a command this bot handles, not one for another bot in the group."""
+    global _own_commands
+    if _own_commands is None:
+        _own_commands = frozenset(
+            command
+            for handlers in context.application.handlers.values()
+            for handler in handlers
+            if isinstance(handler, CommandHandler)
+            for command in handler.commands
+        )
+
+    command, _, username = text.split(maxsplit=1)[0][1:].partition("@")
+    if username and username.lower() != context.bot.username.lower():
+        return False  # Addressed to another bot
+    return command.lower() in _own_commands
+
+
+# Global pre-handler: register with TypeHandler(Update, flood_guard) in a
+# group that runs before the command handlers.
+async def flood_guard(update: Update, context: CallbackContext):
+    message = update.message
+    if not message or not message.text or not message.text.startswith("/"):
+        return  # Only commands are rate limited
+    if not _is_own_command(message.text, context):
+        return  # Commands for other bots, e.g. the game bot, are none of our business
+
+    if not await _apply_flood_control(update):
+        raise ApplicationHandlerStop
+
 # /floods command to show the current flood control settings
 async def floods(update: Update, context: CallbackContext):
     if not is_owner_or_sudo(update.effective_user.id):
@@ -125,33 +378,32 @@ async def set_constants(update: Update, context: CallbackContext):
     constant_name = context.args[0].lower()
     try:
         if constant_name == "cooldown":
-            global COOLDOWN
-            COOLDOWN = int(context.args[1])
+            await store_flood_constant("cooldown", int(context.args[1]))
             await update.message.reply_text(f"✅ COOLDOWN time has been updated to {COOLDOWN} seconds.")
 
         elif constant_name == "spam_threshold":
-            global SPAM_THRESHOLD
-            SPAM_THRESHOLD = int(context.args[1])
+            await store_flood_constant("spam_threshold", int(context.args[1]))
             await update.message.reply_text(f"✅ SPAM_THRESHOLD has been updated to {SPAM_THRESHOLD}.")
 
         elif constant_name == "spam_time_frame":
-            global SPAM_TIME_FRAME
-            SPAM_TIME_FRAME = int(context.args[1])
+            await store_flood_constant("spam_time_frame", int(context.args[1]))
             await update.message.reply_text(f"✅ SPAM_TIME_FRAME has been updated to {SPAM_TIME_FRAME} seconds.")
 
         elif constant_name == "warn_limit":
-            global WARN_LIMIT
-            WARN_LIMIT = int(context.args[1])
+            await store_flood_constant("warn_limit", int(context.args[1]))
             await update.message.reply_text(f"✅ WARN_LIMIT has been updated to {WARN_LIMIT}.")
 
         elif constant_name == "pause_durations":
             durations = [int(x) for x in context.args[1:]]
-            global PAUSE_DURATIONS
-            PAUSE_DURATIONS = durations
+            await store_flood_constant("pause_durations", durations)
             await update.message.reply_text(f"✅ PAUSE_DURATIONS has been updated to {PAUSE_DURATIONS} seconds.")
         
         else:
             await update.message.reply_text("⚠️ Invalid constant name. Valid names: cooldown, spam_threshold, spam_time_frame, warn_limit, pause_durations.")
     except ValueError:
-        await update.message.reply_text("⚠️ Please provide a valid value for the constant.")
+        await update.message.reply_text(
+            "⚠️ Please provide a valid value for the constant: whole numbers of at least 1.\n"
+            "Usage: /set <constant_name> <value>\n"
+            "For pause_durations: /set pause_durations <seconds> [<seconds> ...]"
+        )
 
@@ -3,6 +3,8 @@ from telegram.ext import CallbackQueryHandler, ContextTypes
 import random
 from bson import ObjectId
 from ShinobiCompass.database import db  # Correct import for MongoDB
+from ShinobiCompass.counters import bump_counters
+from ShinobiCompass.shinobi import match_shinobi
 
 # Ensure all interactions happen in private messages
 def is_private_chat(update: Update):
@@ -76,13 +78,14 @@ async def handle_beast_price(update: Update, context: ContextTypes.DEFAULT_TYPE)
     beast_details["price"] = f"{price} {currency}"
 
     # Save beast to database
-    db.items_for_sale.insert_one({
+    await db.items_for_sale.insert_one({
         "seller_id": update.message.from_user.id,
         "category": "beast",
         **beast_details,
         "status": "draft",
         "views": 0
     })
+    await bump_counters(listings=1)
 
     await update.message.reply_text(f"Beast '{beast_details['name']}' has been listed")
 
@@ -120,7 +123,7 @@ async def myitems_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     
     user_id = update.message.from_user.id
-    items = list(db.items_for_sale.find({"seller_id": user_id}))
+    items = await db.items_for_sale.find({"seller_id": user_id}).to_list(length=None)
 
     if not items:
         await update.message.reply_text("You have no items listed for sale.")
@@ -172,6 +175,14 @@ async def handle_item_submission(update: Update, context: ContextTypes.DEFAULT_T
             "quantity": int(lines[1]) if lines[1].isdigit() else 1,
             "price": lines[2]
         }
+
+        if category == "awaken_card":
+            # Store the canonical shinobi name and its class
+            shinobi = match_shinobi(card_name)
+            if not shinobi:
+                await update.message.reply_text("Invalid card name. Please use the name of a known shinobi.")
+                return
+            details["name"], details["legendary"] = shinobi
     elif category == "mask":
         # Check format: quantity, price
         if len(lines) < 2:
@@ -185,13 +196,14 @@ async def handle_item_submission(update: Update, context: ContextTypes.DEFAULT_T
         }
 
     # Save to database
-    db.items_for_sale.insert_one({
+    await db.items_for_sale.insert_one({
         "seller_id": user_id,
         "category": category,
         **details,
         "status": "draft",
         "views": 0
     })
+    await bump_counters(listings=1)
 
     await update.message.reply_text(f"Your {category.replace('_', ' ').title()} '{details['name']}' has been listed.")
 
@@ -208,7 +220,7 @@ def format_item_details(item):
 
 async def myitems_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    items = list(db.items_for_sale.find({"seller_id": user_id}))
+    items = await db.items_for_sale.find({"seller_id": user_id}).to_list(length=None)
 
     if not items:
         await update.message.reply_text("You have no items listed for sale. Use /sell to add items.")
@@ -236,7 +248,7 @@ async def handle_category_selection(update: Update, context: ContextTypes.DEFAUL
     _, category = query.data.split("_")
     user_id = query.from_user.id
 
-    items = list(db.items_for_sale.find({"seller_id": user_id, "category": category}))
+    items = await db.items_for_sale.find({"seller_id": user_id, "category": category}).to_list(length=None)
 
     if not items:
         await query.edit_message_text(f"You have no items in the {category.title()} category.")
@@ -263,7 +275,7 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     item_id = context.args[0]
     try:
-        item = db.items_for_sale.find_one({"_id": ObjectId(item_id)})
+        item = await db.items_for_sale.find_one({"_id": ObjectId(item_id)})
         if not item:
             await update.message.reply_text("Item not found. Please check the ID and try again.")
             return
@@ -295,7 +307,7 @@ async def handle_item_action(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
 
     action, item_id = query.data.split("_")
-    item = db.items_for_sale.find_one({"_id": ObjectId(item_id)})
+    item = await db.items_for_sale.find_one({"_id": ObjectId(item_id)})
 
     if not item:
         await query.edit_message_text("This item could not be found.")
@@ -308,10 +320,11 @@ async def handle_item_action(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await query.edit_message_text("Please reply with the updated details for this item.")
         context.user_data["edit_item_id"] = item_id
     elif action == "onsale":
-        db.items_for_sale.update_one({"_id": ObjectId(item_id)}, {"$set": {"status": "on_sale"}})
+        await db.items_for_sale.update_one({"_id": ObjectId(item_id)}, {"$set": {"status": "on_sale"}})
         await query.edit_message_text("This item is now available for purchase!")
     elif action == "remove":
-        db.items_for_sale.delete_one({"_id": ObjectId(item_id)})
+        result = await db.items_for_sale.delete_one({"_id": ObjectId(item_id)})
+        await bump_counters(listings=-result.deleted_count)
         await query.edit_message_text("This item has been removed from your listings.")
 
 
@@ -324,7 +337,7 @@ async def handle_accept_offer(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.answer()
 
     _, item_id = query.data.split("_")
-    item = db.items_for_sale.find_one({"_id": ObjectId(item_id)})
+    item = await db.items_for_sale.find_one({"_id": ObjectId(item_id)})
 
     if not item:
         await query.edit_message_text("This item could not be found.")
@@ -353,7 +366,7 @@ async def handle_trade_request(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.answer()
 
     _, item_id = query.data.split("_")
-    item = db.items_for_sale.find_one({"_id": ObjectId(item_id)})
+    item = await db.items_for_sale.find_one({"_id": ObjectId(item_id)})
 
     if not item:
         await query.edit_message_text("This item could not be found.")
@@ -374,7 +387,7 @@ async def handle_price_negotiation(update: Update, context: ContextTypes.DEFAULT
     await query.answer()
 
     _, item_id = query.data.split("_")
-    item = db.items_for_sale.find_one({"_id": ObjectId(item_id)})
+    item = await db.items_for_sale.find_one({"_id": ObjectId(item_id)})
 
     if not item:
         await query.edit_message_text("This item could not be found.")
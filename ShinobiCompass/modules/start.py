@@ -1,3 +1,5 @@
+import html
+import os
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext
 from ShinobiCompass.database import db
@@ -7,10 +9,67 @@ from ShinobiCompass.modules.verify import require_verification
 # Reference to the new collection
 collection = db.message_collector  
 
+NO_UPDATES_TEXT = "❄️ No Updates Available. Stay cozy and check back later!"
+
+# The main menu keyboard never changes, so build it once
+START_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📖 Help", callback_data="help_bm_commands")],
+    [InlineKeyboardButton("📣 Updates", callback_data="show_updates")],
+])
+
+UPDATE_MESSAGE_REFRESH_INTERVAL = int(os.getenv("UPDATE_MESSAGE_REFRESH_INTERVAL", "30"))  # seconds
+
+# Pre-rendered /start template (filled with the user's name) and updates page.
+# The update message only changes through /update and /emptyupdate, which
+# refresh these write-through and bump the document's version so other
+# replicas reload it on their next poll.
+_welcome_template = ""
+_updates_page = ""
+_update_version = None
+
+def _render_update_message(update_text: str | None) -> None:
+    global _welcome_template, _updates_page
+    update_text = update_text or NO_UPDATES_TEXT
+
+    # Checking the update status
+    if update_text == NO_UPDATES_TEXT:
+        update_status = "🔴 Stay tuned for next update or upcoming updates"
+    else:
+        update_status = "🟠 Check Out"
+
+    _welcome_template = (
+        "❄️<b>Welcome, {name}!</b>❄️\n\n"
+        "⛄ <b>Your Assistant Bot for Naruto Game Bot is here to keep you warm this winter!</b>\n"
+        "Let me help you analyze black market deals, manage tasks, and much more as the cold breeze rolls in!\n\n"
+        "🌨️ <b>Winter Features:</b>\n"
+        "🔥 Black Market Analysis\n"
+        "🧣 Task Management\n"
+        "🧤 Inventory Tracking\n\n"
+        "☃️ <b>Current Updates:</b>\n"
+        f"{update_status}\n\n"
+        "❄️🎄Wishing you warmth, joy, and plenty of rewards this winter! 🎄❄️"
+    )
+    _updates_page = f"📣 <b>Updates:</b>\n\n{update_text}"
+
+_render_update_message(None)
+
+async def load_update_message() -> None:
+    """Load the stored update message into memory (called at startup)."""
+    global _update_version
+    update_message = await collection.find_one({"_id": "update_message"})
+    _render_update_message(update_message["message"] if update_message else None)
+    _update_version = update_message.get("version", 0) if update_message else 0
+
+async def refresh_update_message() -> None:
+    """Reload the update message only when another replica changed it."""
+    doc = await collection.find_one({"_id": "update_message"}, {"version": 1})
+    if (doc.get("version", 0) if doc else 0) != _update_version:
+        await load_update_message()
+
 # Command for sudo users/owners to update the message
 async def update_message(update: Update, context: CallbackContext) -> None:
     user = update.effective_user
-    if not await is_owner_or_sudo(update):
+    if not is_owner_or_sudo(update):
         await update.message.reply_text("❌ You are not authorized to use this command.")
         return
 
@@ -24,7 +83,8 @@ async def update_message(update: Update, context: CallbackContext) -> None:
 
     if new_message:
         # Update the document in the new collection
-        collection.update_one({"_id": "update_message"}, {"$set": {"message": new_message}}, upsert=True)
+        await collection.update_one({"_id": "update_message"}, {"$set": {"message": new_message}, "$inc": {"version": 1}}, upsert=True)
+        _render_update_message(new_message)
         await update.message.reply_text(f"✅ Update message set to:\n\n<b>{new_message}</b>", parse_mode="HTML")
     else:
         await update.message.reply_text("⚠️ The replied message is empty.")
@@ -32,12 +92,13 @@ async def update_message(update: Update, context: CallbackContext) -> None:
 # Command for sudo users/owners to clear the message
 async def empty_update(update: Update, context: CallbackContext) -> None:
     user = update.effective_user
-    if not await is_owner_or_sudo(update):
+    if not is_owner_or_sudo(update):
         await update.message.reply_text("❌ You are not authorized to use this command.")
         return
 
     # Clear the update message
-    collection.update_one({"_id": "update_message"}, {"$set": {"message": None}}, upsert=True)
+    await collection.update_one({"_id": "update_message"}, {"$set": {"message": None}, "$inc": {"version": 1}}, upsert=True)
+    _render_update_message(None)
     await update.message.reply_text("✅ Update message cleared.")
 
 # Start command with updated message status
@@ -47,39 +108,11 @@ async def start(update: Update, context: CallbackContext) -> None:
     if not update.message:
         return  # If there's no message object, exit the function early
 
-    # Fetch the update message from the database
-    update_message = collection.find_one({"_id": "update_message"})
-    update_text = update_message["message"] if update_message and update_message["message"] else "❄️ No Updates Available. Stay cozy and check back later!"
-    
-    user = update.effective_user
-
-    # Checking the update status
-    if update_text == "❄️ No Updates Available. Stay cozy and check back later!":
-        update_status = "🔴 Stay tuned for next update or upcoming updates"
-    else:
-        update_status = "🟠 Check Out"
-
-    buttons = [
-        [InlineKeyboardButton("📖 Help", callback_data="help_bm_commands")],
-        [InlineKeyboardButton("📣 Updates", callback_data="show_updates")],
-    ]
-    reply_markup = InlineKeyboardMarkup(buttons)
-    
-    welcome_message = (
-        f"❄️<b>Welcome, {user.first_name}!</b>❄️\n\n"
-        "⛄ <b>Your Assistant Bot for Naruto Game Bot is here to keep you warm this winter!</b>\n"
-        "Let me help you analyze black market deals, manage tasks, and much more as the cold breeze rolls in!\n\n"
-        "🌨️ <b>Winter Features:</b>\n"
-        "🔥 Black Market Analysis\n"
-        "🧣 Task Management\n"
-        "🧤 Inventory Tracking\n\n"
-        "☃️ <b>Current Updates:</b>\n"
-        f"{update_status}\n\n"
-        "❄️🎄Wishing you warmth, joy, and plenty of rewards this winter! 🎄❄️"
-    )
+    # Only the user's name is dynamic; the rest is pre-rendered
+    welcome_message = _welcome_template.format(name=html.escape(update.effective_user.first_name))
 
     # Send the welcome message if update.message exists
-    await update.message.reply_text(welcome_message, parse_mode="HTML", reply_markup=reply_markup)
+    await update.message.reply_text(welcome_message, parse_mode="HTML", reply_markup=START_MARKUP)
 
 # Updated help callback handler
 async def help_callback_handler(update: Update, context: CallbackContext) -> None:
@@ -162,11 +195,7 @@ async def show_updates_callback(update: Update, context: CallbackContext) -> Non
     query = update.callback_query
     await query.answer()
     
-    # Fetch the update message from the database
-    update_message = collection.find_one({"_id": "update_message"})
-    update_text = update_message["message"] if update_message and update_message["message"] else "❄️ No Updates Available. Stay cozy and check back later!"
-    
-    await query.edit_message_text(f"📣 <b>Updates:</b>\n\n{update_text}", parse_mode="HTML")
+    await query.edit_message_text(_updates_page, parse_mode="HTML")
 
 # Back to Main Menu Command
 async def back_to_main(update: Update, context: CallbackContext) -> None:
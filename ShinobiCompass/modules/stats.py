@@ -1,20 +1,36 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
-from ShinobiCompass.database import db  # Assuming db is already initialized to work with MongoDB
+from ShinobiCompass.database import db, get_pool_stats  # Assuming db is already initialized to work with MongoDB
+from ShinobiCompass.counters import read_counters
 from ShinobiCompass.modules.sudo import is_owner_or_sudo
+from ShinobiCompass.modules.verify import verification_cache
+from ShinobiCompass.scheduler import scheduler
+from ShinobiCompass.outbox import outbox
+from ShinobiCompass.modules.bm import report_stats
+from ShinobiCompass.modules.directory import lookup_names
+import html
+
+USERS_PAGE_SIZE = 20  # Users per page of the "Users" listing
 
 # Command to show stats: Total users and total groups with buttons
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Check if the user is the owner or a sudo user
-    if not await is_owner_or_sudo(update):
+    if not is_owner_or_sudo(update):
         await update.message.reply_text("<b>⚠ You must be the owner or a sudo user to use this command.</b>", parse_mode="HTML")
         return
 
-    # Get total counts for users and groups
-    user_count = db.users.count_documents({})
+    # Read the materialized totals (one point read, whatever the collection sizes)
+    counts = await read_counters()
 
-    # Prepare the message with total users and groups
-    message_text = f"<b>Total Users: {user_count}</b>"
+    # Prepare the message with the totals
+    message_text = (
+        f"<b>📊 Bot Stats</b>\n\n"
+        f"┣ <b>Total Users:</b> {counts['users']}\n"
+        f"┣ <b>Verified Users:</b> {counts['verified_users']}\n"
+        f"┣ <b>Groups:</b> {counts['groups']}\n"
+        f"┣ <b>Active Tasks:</b> {counts['active_tasks']}\n"
+        f"┗ <b>Listings:</b> {counts['listings']}"
+    )
 
     # Create inline keyboard with buttons
     keyboard = [
@@ -34,27 +50,19 @@ async def handle_stats_buttons(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     await query.answer()  # Acknowledge the button press
 
-    if query.data == "users":
-        # Fetch all users from the database
-        users_cursor = db.users.find()
-
-        # Prepare user list
-        user_list = "<b>📜 List of Users:</b>\n\n"
-        for user in users_cursor:  # Use regular `for` loop
-            user_id = user['user_id']
-            try:
-                # Fetch user details using their user_id
-                user_info = await context.bot.get_chat(user_id)  # Fetch user details from Telegram
-                user_name = user_info.first_name  # Get the user's first name
-                
-                # Format each user's information
-                user_list += f"🔸 <a href='tg://user?id={user_id}'>{user_name}</a> || <code>{user_id}</code>\n"
-            except Exception as e:
-                # Handle error if user details cannot be fetched
-                user_list += f"⚠️ <b>User ID:</b> <code>{user_id}</code> (Error: {str(e)})\n"
+    if query.data == "users" or query.data.startswith(("users_next:", "users_prev:")):
+        # "users" opens the first page; the navigation buttons carry the
+        # user_id at the edge of the current page
+        if query.data == "users":
+            direction, anchor = "next", None
+        else:
+            direction, anchor = query.data.split(":")
+            direction, anchor = direction[len("users_"):], int(anchor)
+
+        user_list, reply_markup = await _render_users_page(direction, anchor)
 
         # Send the formatted list
-        await query.edit_message_text(user_list, parse_mode="HTML")
+        await query.edit_message_text(user_list, parse_mode="HTML", reply_markup=reply_markup)
 
     elif query.data == "exit":
         # Handle exit button: Edit message with exit text
@@ -65,3 +73,82 @@ async def handle_stats_buttons(update: Update, context: ContextTypes.DEFAULT_TYP
         await stats(update, context)
 
 
+async def _render_users_page(direction: str, anchor: int | None):
+    """Render one page of users using a range query on the indexed user_id."""
+    if direction == "next":
+        filter_ = {"user_id": {"$gt": anchor}} if anchor is not None else {}
+        sort_order = 1
+    else:
+        filter_ = {"user_id": {"$lt": anchor}}
+        sort_order = -1
+
+    # Fetch one extra user to know whether there is another page that way
+    users = await db.users.find(filter_, {"_id": 0, "user_id": 1, "name": 1}) \
+        .sort("user_id", sort_order).limit(USERS_PAGE_SIZE + 1).to_list(length=USERS_PAGE_SIZE + 1)
+    more = len(users) > USERS_PAGE_SIZE
+    users = users[:USERS_PAGE_SIZE]
+    if direction == "next":
+        has_prev, has_next = anchor is not None, more
+    else:
+        users.reverse()
+        has_prev, has_next = more, True
+
+    if not users:
+        return "<b>📜 No users found.</b>", None
+
+    # Names come from the user directory instead of one Telegram call per user
+    names = await lookup_names([user['user_id'] for user in users])
+
+    # Prepare user list
+    user_list = "<b>📜 List of Users:</b>\n\n"
+    for user in users:
+        user_id = user['user_id']
+        user_name = names.get(user_id) or user.get('name') or str(user_id)
+
+        # Format each user's information
+        user_list += f"🔸 <a href='tg://user?id={user_id}'>{html.escape(user_name)}</a> || <code>{user_id}</code>\n"
+
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"users_prev:{users[0]['user_id']}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"users_next:{users[-1]['user_id']}"))
+    reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    return user_list, reply_markup
+
+
+# Command to show runtime performance metrics (connection pool usage)
+async def perf_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_owner_or_sudo(update):
+        await update.message.reply_text("<b>⚠ You must be the owner or a sudo user to use this command.</b>", parse_mode="HTML")
+        return
+
+    pool = get_pool_stats()
+    verify = verification_cache.stats()
+    jobs = scheduler.stats()
+    sends = outbox.stats()
+    reports = report_stats()
+    message_text = (
+        "<b>📊 Performance Stats</b>\n\n"
+        "<b>MongoDB Pool:</b>\n"
+        f"┣ Open Connections: {pool['open_connections']}/{pool['max_pool_size']}\n"
+        f"┣ Checked Out: {pool['checked_out']} (peak {pool['max_checked_out']})\n"
+        f"┣ Checkouts: {pool['checkouts']} (failed {pool['checkout_failures']})\n"
+        f"┗ Wait Time: avg {pool['avg_wait_ms']:.2f} ms, max {pool['max_wait_ms']:.2f} ms\n\n"
+        "<b>Verification Cache:</b>\n"
+        f"┣ Entries: {verify['size']}/{verify['maxsize']}\n"
+        f"┗ Hits: {verify['hits']}, Misses: {verify['misses']} ({verify['hit_rate']:.1%})\n\n"
+        "<b>Scheduler:</b>\n"
+        f"┣ Queue Depth: {jobs['queue_depth']}\n"
+        f"┣ Executed: {jobs['executed']} (failed {jobs['failed']}, {jobs['batches']} batches)\n"
+        f"┗ Lateness: avg {jobs['avg_lateness_ms']:.0f} ms, max {jobs['max_lateness_ms']:.0f} ms\n\n"
+        "<b>Outbox:</b>\n"
+        f"┣ Queue Depth: {sends['queue_depth']} (parked {sends['parked']}, in flight {sends['in_flight']})\n"
+        f"┣ Sent: {sends['sent']} (failed {sends['failed']}, {sends['retries']} retries)\n"
+        f"┗ Latency: avg {sends['avg_latency_ms']:.0f} ms, max {sends['max_latency_ms']:.0f} ms\n\n"
+        "<b>Black Market Reports:</b>\n"
+        f"┣ Entries: {reports['size']}/{reports['maxsize']}\n"
+        f"┣ Hits: {reports['hits']}, Misses: {reports['misses']} ({reports['hit_rate']:.1%})\n"
+        f"┗ Shared In-Flight: {reports['shared']}\n"
+    )
+    await update.message.reply_text(message_text, parse_mode="HTML")
@@ -1,10 +1,50 @@
 from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler
 from ShinobiCompass.database import db  # Assuming db is already initialized to work with MongoDB
+from ShinobiCompass.modules.directory import lookup_names
+import html
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 OWNER_ID = 5956598856
 SUDO_USERS_COLLECTION = "sudo_users"
+SUDO_REFRESH_INTERVAL = int(os.getenv("SUDO_REFRESH_INTERVAL", "30"))  # seconds
+
+# Authoritative in-memory copy of the sudo users, kept in sync with MongoDB.
+# Every change bumps a version counter in `settings` so other replicas can
+# notice it with a single point read.
+sudo_ids: set[int] = set()
+_sudo_version = None
+
+async def _read_sudo_version():
+    doc = await db.settings.find_one({"_id": "sudo_version"}, {"version": 1})
+    return doc["version"] if doc else 0
+
+async def _bump_sudo_version() -> None:
+    global _sudo_version
+    doc = await db.settings.find_one_and_update(
+        {"_id": "sudo_version"},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=True
+    )
+    _sudo_version = doc["version"]
+
+async def load_sudo_users() -> None:
+    """(Re)load the sudo set from MongoDB."""
+    global sudo_ids, _sudo_version
+    version = await _read_sudo_version()
+    cursor = db[SUDO_USERS_COLLECTION].find({}, {"user_id": 1, "_id": 0})
+    sudo_ids = {doc["user_id"] async for doc in cursor}
+    _sudo_version = version
+    logger.info(f"Loaded {len(sudo_ids)} sudo users (version {version}).")
+
+async def refresh_sudo_users() -> None:
+    """Reload the sudo set only if another replica changed it."""
+    if await _read_sudo_version() != _sudo_version:
+        await load_sudo_users()
 
 # Helper function to check if the user is the owner
 async def is_owner(update: Update) -> bool:
@@ -21,20 +61,21 @@ async def is_owner(update: Update) -> bool:
     return False
 
 # Helper function to check if the user is the owner or a sudo user
-async def is_owner_or_sudo(update: Update) -> bool:
-    """Check if the user is the owner or a sudo user."""
-    if not update.effective_user:  # Ensure `effective_user` exists
-        return False
-
-    user_id = update.effective_user.id
+def is_owner_or_sudo(user: Update | int) -> bool:
+    """Check if the user is the owner or a sudo user.
 
-    # Check if the user is the owner
-    if user_id == OWNER_ID:
-        return True
+    Accepts either an Update or a plain user ID and never touches the
+    database, so it is safe to call from sync and async code alike.
+    """
+    if isinstance(user, Update):
+        if not user.effective_user:  # Ensure `effective_user` exists
+            return False
+        user_id = user.effective_user.id
+    else:
+        user_id = user
 
-    # Check if the user is a sudo user by querying MongoDB
-    sudo_user = db[SUDO_USERS_COLLECTION].find_one({"user_id": user_id})
-    return bool(sudo_user)
+    # Check if the user is the owner or in the in-memory sudo set
+    return user_id == OWNER_ID or user_id in sudo_ids
 
 
 # Command to add a sudo user
@@ -49,11 +90,13 @@ async def addsudo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user_name = user_info.first_name
 
         # Add user to the sudo users collection in MongoDB
-        db[SUDO_USERS_COLLECTION].update_one(
+        await db[SUDO_USERS_COLLECTION].update_one(
             {"user_id": user_id},
             {"$set": {"user_id": user_id, "first_name": user_name}},
             upsert=True  # If the user doesn't exist, it will be created
         )
+        sudo_ids.add(user_id)
+        await _bump_sudo_version()
 
         await update.message.reply_text(f"<b>{user_name} (ID: {user_id})</b> has been added to the sudo users list.", parse_mode="HTML")
     except (IndexError, ValueError):
@@ -69,7 +112,9 @@ async def removesudo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         user_id = int(context.args[0])  # Get user ID from command argument
 
         # Remove user from the sudo users collection
-        db[SUDO_USERS_COLLECTION].delete_one({"user_id": user_id})
+        await db[SUDO_USERS_COLLECTION].delete_one({"user_id": user_id})
+        sudo_ids.discard(user_id)
+        await _bump_sudo_version()
 
         await update.message.reply_text(f"<b>User with ID: {user_id}</b> has been removed from the sudo users list.", parse_mode="HTML")
     except (IndexError, ValueError):
@@ -80,25 +125,26 @@ async def removesudo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 # Command to list all sudo users
 async def sudolist(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Check if the user is authorized (owner or sudo user)
-    if not await is_owner_or_sudo(update):
+    if not is_owner_or_sudo(update):
         await update.message.reply_text("<b>⚠ You must be the owner or a sudo user to use this command.</b>", parse_mode="HTML")
         return
 
     # Fetch all sudo users from the collection
-    sudo_users_cursor = db[SUDO_USERS_COLLECTION].find()
+    sudo_users = await db[SUDO_USERS_COLLECTION].find({}, {"_id": 0, "user_id": 1, "first_name": 1}).to_list(length=None)
+
+    # Current names come from the user directory, falling back to the name stored by /addsudo
+    names = await lookup_names([user['user_id'] for user in sudo_users])
 
     # Prepare the message to list sudo users
     sudo_users_message = "<b>List of Sudo Users:</b>\n"
 
-    # Loop through the cursor synchronously
-    for user in sudo_users_cursor:
+    for user in sudo_users:
         user_id = user['user_id']
-        try:
-            user_info = await context.bot.get_chat(user_id)  # Get user details from Telegram
-            user_name = user_info.first_name
-            sudo_users_message += f"<b>{user_name}</b> - <a href='tg://user?id={user_id}'>User Link</a> ({user_id})\n"
-        except Exception as e:
-            sudo_users_message += f"<b>User ID:</b> {user_id} (Could not fetch details - {str(e)})\n"
+        user_name = names.get(user_id) or user.get('first_name')
+        if user_name:
+            sudo_users_message += f"<b>{html.escape(user_name)}</b> - <a href='tg://user?id={user_id}'>User Link</a> ({user_id})\n"
+        else:
+            sudo_users_message += f"<b>User ID:</b> {user_id} - <a href='tg://user?id={user_id}'>User Link</a>\n"
 
     # Handle the case when no sudo users are found
     if sudo_users_message == "<b>List of Sudo Users:</b>\n":
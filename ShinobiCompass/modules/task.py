@@ -2,26 +2,67 @@ import pytz
 from datetime import datetime, timedelta
 from telegram import Update
 import telegram
-import asyncio
 from telegram.ext import CallbackContext
 from ShinobiCompass.database import db
+from ShinobiCompass.cache import TTLCache
+from ShinobiCompass.counters import bump_counters
+from ShinobiCompass.outbox import outbox, BULK
+from ShinobiCompass.scheduler import scheduler, job_handler
 from ShinobiCompass.modules.verify import require_verification
 from ShinobiCompass.modules.sudo import is_owner_or_sudo
+from ShinobiCompass.modules.directory import resolve_names
+import html
 import re
 import uuid
+from pymongo.errors import DuplicateKeyError
 
 # Assuming tasks_collection is a collection in your database
 tasks_collection = db['tasks_collection']
+# One document per (task_id, user_id) holding the user's finv/linv glory
+submissions_collection = db['task_submissions']
 
 # Timezone setup
 IST = pytz.timezone('Asia/Kolkata')
 
+# Running tasks per chat, so a burst of /finv or /linv in a group does not
+# look the task up again for every submission
+TASK_PROJECTION = {"task_id": 1, "chat_id": 1, "start_time": 1, "end_time": 1}
+running_task_cache = TTLCache(maxsize=1000, ttl=30)
+
+# Participants shown per leaderboard message (keeps each under Telegram's 4096 chars)
+LEADERBOARD_PAGE_SIZE = 25
+
+def _as_aware(value: datetime) -> datetime:
+    # MongoDB hands back naive UTC datetimes
+    return pytz.utc.localize(value) if value.tzinfo is None else value
+
+async def get_running_task(chat_id: int, now: datetime) -> dict | None:
+    """Return the task currently running in a chat, served from cache when possible."""
+    task = running_task_cache.get(chat_id)
+    if task is None:
+        task = await tasks_collection.find_one(
+            {"chat_id": chat_id, "start_time": {"$lt": now}, "end_time": {"$gt": now}},
+            TASK_PROJECTION
+        )
+        if task is None:
+            return None
+        task['start_time'] = _as_aware(task['start_time'])
+        task['end_time'] = _as_aware(task['end_time'])
+        running_task_cache.set(chat_id, task)
+
+    if not task['start_time'] <= now < task['end_time']:
+        running_task_cache.invalidate(chat_id)
+        return None
+    return task
+
 async def is_admin(update: Update, context: CallbackContext) -> bool:
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     member = await context.bot.get_chat_member(chat_id, user_id)
     return member.status in ['administrator', 'creator']
 
+TASK_ID_ATTEMPTS = 5  # Fresh IDs tried when a 5-digit ID is already taken
+
 async def generate_task_id(chat_id: int) -> str:
     return str(uuid.uuid4().int)[:5]
 
@@ -94,7 +135,7 @@ async def set_task(update: Update, context: CallbackContext) -> None:
         chat_id = update.effective_chat.id
 
         # Check if there is already an active task in the database for this chat
-        existing_task = tasks_collection.find_one({"chat_id": chat_id, "end_time": {"$gt": now_ist}})
+        existing_task = await tasks_collection.find_one({"chat_id": chat_id, "end_time": {"$gt": now_ist}})
         if existing_task:
             await update.message.reply_text("A task is already active for today. Please wait until the current task ends before creating a new one.")
             return
@@ -126,10 +167,22 @@ async def set_task(update: Update, context: CallbackContext) -> None:
             "description": description,
             "reward_value": int(reward_value),
             "reward_type": reward_type.lower(),
+            "start_time_str": start_time_str,
+            "end_time_str": end_time_str,
             "created_at": now_ist,
             "verified_users": [],
         }
-        tasks_collection.insert_one(task)
+        # task_id is unique; on the rare collision draw a new ID and try again
+        for attempt in range(TASK_ID_ATTEMPTS):
+            try:
+                await tasks_collection.insert_one(task)
+                break
+            except DuplicateKeyError:
+                if attempt == TASK_ID_ATTEMPTS - 1:
+                    raise
+                task.pop("_id", None)
+                task_id = task["task_id"] = await generate_task_id(chat_id)
+        await bump_counters(active_tasks=1)
 
         # Determine the task message based on start time
         message = await context.bot.send_message(
@@ -146,15 +199,23 @@ async def set_task(update: Update, context: CallbackContext) -> None:
         )
 
         # Update the task with the message ID and pin it
-        tasks_collection.update_one({"task_id": task_id}, {"$set": {"message_id": message.message_id}})
+        await tasks_collection.update_one({"task_id": task_id}, {"$set": {"message_id": message.message_id}})
         await context.bot.pin_chat_message(chat_id, message.message_id)
 
-        # Schedule task to edit the message after the start time
-        delay = (start_time - now_ist).total_seconds()
-        asyncio.create_task(task_message(context, chat_id, message.message_id, task_id, start_time_str, end_time_str, description, reward_value, reward_type.lower(), delay))
-
-        # Schedule task to delete task data and unpin message after 12 hours
-        asyncio.create_task(delete_task_data(context, task, chat_id))
+        # Schedule the start edit, and the leaderboard/unpin/cleanup at the end time.
+        # Both jobs are persisted, so they survive restarts. They are keyed by
+        # the task's _id, since 5-digit task IDs are reused.
+        await scheduler.schedule("task_start", start_time, {
+            "chat_id": chat_id,
+            "message_id": message.message_id,
+            "task_id": task_id,
+            "start_time_str": start_time_str,
+            "end_time_str": end_time_str,
+            "description": description,
+            "reward_value": reward_value,
+            "reward_type": reward_type.lower(),
+        }, job_id=f"task_start:{task['_id']}", group=chat_id)
+        await scheduler.schedule("task_end", end_time, {"chat_id": chat_id, "task_id": task_id}, job_id=f"task_end:{task['_id']}", group=chat_id)
 
     except (IndexError, ValueError) as e:
         print(f"Error: {e}")
@@ -169,17 +230,25 @@ async def set_task(update: Update, context: CallbackContext) -> None:
 
 
 
-async def task_message(context: CallbackContext, chat_id: int, message_id: int, task_id: int, start_time_str: str, end_time_str: str, description: str, reward_value: int, reward_type: str, delay: float):
-    await asyncio.sleep(delay)
-    await context.bot.edit_message_text(
-        chat_id=chat_id,
-        message_id=message_id,
+@job_handler("task_start")
+async def task_message(bot: telegram.Bot, payload: dict):
+    # When catching up after downtime the task may already have ended (and been
+    # cleaned up); announcing its start would overwrite the result
+    task = await tasks_collection.find_one(
+        {"task_id": payload['task_id'], "end_time": {"$gt": datetime.now(IST)}}, {"_id": 1}
+    )
+    if not task:
+        return
+
+    await bot.edit_message_text(
+        chat_id=payload['chat_id'],
+        message_id=payload['message_id'],
         text=(
             f"<b><u>📝 Today's Task</u></b>\n"
-            f"<b>Task ID:</b><code>{task_id}</code>\n\n"
-            f"<b>Task Time:</b> <i>{start_time_str} - {end_time_str}</i>\n\n"
-            f"<b>Description:</b> <i>{description}</i>\n"
-            f"<b>Reward:</b> <i>{reward_value} {reward_type}</i>\n\n"
+            f"<b>Task ID:</b><code>{payload['task_id']}</code>\n\n"
+            f"<b>Task Time:</b> <i>{payload['start_time_str']} - {payload['end_time_str']}</i>\n\n"
+            f"<b>Description:</b> <i>{payload['description']}</i>\n"
+            f"<b>Reward:</b> <i>{payload['reward_value']} {payload['reward_type']}</i>\n\n"
             f"<b>How to Participate:</b>\n"
             f"1️⃣ <b>/finv</b> — Submit your starting inventory.\n"
             f"2️⃣ <b>/linv</b> — Submit your last inventory.\n\n"
@@ -189,7 +258,7 @@ async def task_message(context: CallbackContext, chat_id: int, message_id: int,
     )
 
 async def edit_task_message(
-    context: CallbackContext,
+    bot: telegram.Bot,
     chat_id: int,
     message_id: int,
     task_id: int,
@@ -207,7 +276,7 @@ async def edit_task_message(
     )
 
     # Edit the task message
-    await context.bot.edit_message_text(
+    await bot.edit_message_text(
         chat_id=chat_id,
         message_id=message_id,
         text=task_message_text,
@@ -217,58 +286,65 @@ async def edit_task_message(
     # Pin the task message if required
     if pin:
         try:
-            await context.bot.pin_chat_message(chat_id, message_id=message_id)
-        except telegram.error.BadRequest as e:
+            await bot.pin_chat_message(chat_id, message_id=message_id)
+        except telegram.error.TelegramError as e:
             print(f"Error while pinning the message: {e}")
 
 
-async def delete_task_data(context: CallbackContext, task: dict, chat_id: int):
-    now_ist = datetime.now(IST)
-    task_end_time = task['end_time']
-    delay = (task_end_time - now_ist).total_seconds()
-
-    # Wait for the task duration
-    if delay > 0:
-        await asyncio.sleep(delay)
+@job_handler("task_end")
+async def delete_task_data(bot: telegram.Bot, payload: dict):
+    # Runs as a retried scheduler job, so every step must be safe to repeat
+    chat_id = payload['chat_id']
+    task = await tasks_collection.find_one({"task_id": payload['task_id']})
+    if not task:
+        return  # Canceled or cleared in the meantime
 
-    # Try to generate and pin the leaderboard
-    leaderboard_message_id = None
     try:
-        leaderboard_message_id = await taskresult(chat_id, context)
-    except Exception as e:
-        print(f"Error generating leaderboard: {e}")
-
-    # Unpin the previous task message if it exists
-    if 'message_id' in task:
-        try:
-            await context.bot.unpin_chat_message(chat_id, task['message_id'])
-        except telegram.error.BadRequest as e:
-            print(f"Error while unpinning task message: {e}")
+        # Post the leaderboard once; a retry finds its message ID on the task
+        leaderboard_message_id = task.get('leaderboard_message_id')
+        if 'leaderboard_message_id' not in task:
+            try:
+                leaderboard_message_id = await taskresult(chat_id, bot, task)
+            except Exception as e:
+                print(f"Error generating leaderboard: {e}")
 
-    # Update the task message to indicate it has ended
-    if 'message_id' in task:
-        pin_task_message = leaderboard_message_id is None  # Pin task message if no leaderboard exists
-        await edit_task_message(
-            context,
-            chat_id=chat_id,
-            message_id=task['message_id'],
-            task_id=task['task_id'],
-            start_time_str=task['start_time_str'],
-            end_time_str=task['end_time_str'],
-            description=task['description'],
-            reward_value=task['reward_value'],
-            reward_type=task['reward_type'],
-            pin=pin_task_message
-        )
+        # Unpin the previous task message if it exists
+        if 'message_id' in task:
+            try:
+                await bot.unpin_chat_message(chat_id, task['message_id'])
+            except telegram.error.TelegramError as e:
+                print(f"Error while unpinning task message: {e}")
 
-    # Delete the task from the database
-    tasks_collection.delete_one({"_id": task['_id']})
+        # Update the task message to indicate it has ended
+        if 'message_id' in task:
+            pin_task_message = leaderboard_message_id is None  # Pin task message if no leaderboard exists
+            try:
+                await edit_task_message(
+                    bot,
+                    chat_id=chat_id,
+                    message_id=task['message_id'],
+                    task_id=task['task_id'],
+                    start_time_str=task['start_time_str'],
+                    end_time_str=task['end_time_str'],
+                    description=task['description'],
+                    reward_value=task['reward_value'],
+                    reward_type=task['reward_type'],
+                    pin=pin_task_message
+                )
+            except telegram.error.TelegramError as e:
+                print(f"Error while editing the task message: {e}")
+    finally:
+        # Delete the task and its submissions from the database
+        result = await tasks_collection.delete_one({"_id": task['_id']})
+        await bump_counters(active_tasks=-result.deleted_count)
+        await submissions_collection.delete_many({"task_id": task['task_id']})
+        running_task_cache.invalidate(chat_id)
 
     # Pin the leaderboard message if it exists
     if leaderboard_message_id:
         try:
-            await context.bot.pin_chat_message(chat_id, leaderboard_message_id)
-        except telegram.error.BadRequest as e:
+            await bot.pin_chat_message(chat_id, leaderboard_message_id)
+        except telegram.error.TelegramError as e:
             print(f"Error while pinning leaderboard: {e}")
 
     
@@ -301,7 +377,7 @@ async def submit_inventory(update: Update, context: CallbackContext) -> None:
             return
 
         # Find the task by task_id in PM
-        task = tasks_collection.find_one({"task_id": task_id})
+        task = await tasks_collection.find_one({"task_id": task_id}, TASK_PROJECTION)
         if not task:
             await update.message.reply_text("Invalid task ID. \n Use /finv task_id || /linv task_id \n Task id is given in Task message in the group !!")
             return
@@ -338,27 +414,12 @@ async def submit_inventory(update: Update, context: CallbackContext) -> None:
 
         inventory_message = update.message.reply_to_message.text
 
-        # Find an active task for the current chat
-        task = tasks_collection.find_one({"chat_id": chat_id, "start_time": {"$lt": now_ist}, "end_time": {"$gt": now_ist}})
+        # Find the running task for the current chat (already checked to have started)
+        task = await get_running_task(chat_id, now_ist)
         if not task:
             await update.message.reply_text("No active task to submit inventory for.")
             return
 
-        # Safely access task start_time after checking the task
-        task_start_time = task.get('start_time')
-        if not task_start_time:
-            await update.message.reply_text("Task does not have a valid start time.")
-            return
-
-        # Convert task start time to be aware if it's naive
-        if task_start_time.tzinfo is None:
-            task_start_time = IST.localize(task_start_time)
-
-        # Compare times: now_ist should be aware, task_start_time is aware
-        if now_ist < task_start_time:
-            await update.message.reply_text("The event has not started yet. Please wait until the start time.")
-            return
-
         # Verify the message is from the authorized bot (by sender ID)
         if update.message.reply_to_message.from_user.id != 5416991774:
             await update.message.reply_text("The inventory message must be from the authorized bot.")
@@ -381,116 +442,164 @@ async def submit_inventory(update: Update, context: CallbackContext) -> None:
             return
         my_glory = int(glory_match.group(1))
 
-    # Submit starting or ending inventory
+    submission_key = {"task_id": task['task_id'], "user_id": user_id}
+
+    # Submit starting or ending inventory. Each submission is a single
+    # conditional write; the duplicate checks are enforced by the server.
     if inventory_type == "finv":
-        if f"finv_{user_id}" in task:
+        # The unique (task_id, user_id) index rejects a second start
+        try:
+            await submissions_collection.insert_one({
+                **submission_key,
+                "chat_id": task['chat_id'],
+                "finv": my_glory,
+                "submitted_at": now_ist,
+            })
+        except DuplicateKeyError:
             await update.message.reply_text("⚠️Starting inventory has already been submitted.⚠️")
             return
-        
-        # Update the task with starting inventory
-        result = tasks_collection.update_one(
-            {"_id": task['_id']},
-            {"$set": {f"finv_{user_id}": my_glory}}
-        )
-
-        if result.modified_count == 1:
-            await update.message.reply_text("Starting inventory submitted successfully.")
-        else:
-            await update.message.reply_text("Failed to submit starting inventory. Please try again.")
-        return
 
-    elif inventory_type == "linv":
-        if f"linv_{user_id}" in task:
-            await update.message.reply_text("⚠️Ending inventory has already been submitted.⚠️")
+        # The task may have been canceled or cleared (possibly on another
+        # replica, past our cached copy) after we found it. Its cleanup only
+        # deletes the submissions that existed then, so remove a late one here.
+        if not await tasks_collection.count_documents({"_id": task['_id']}, limit=1):
+            await submissions_collection.delete_one(submission_key)
+            await update.message.reply_text("No active task to submit inventory for.")
             return
 
-        # Ensure starting inventory is submitted first
-        if f"finv_{user_id}" not in task:
-            await update.message.reply_text("You must submit the starting inventory first.")
-            return
+        await update.message.reply_text("Starting inventory submitted successfully.")
+        return
 
-        # Update the task with ending inventory
-        result = tasks_collection.update_one(
-            {"_id": task['_id']},
-            {"$set": {f"linv_{user_id}": my_glory}}
+    elif inventory_type == "linv":
+        # Only matches if the start was submitted and the end was not
+        submission = await submissions_collection.find_one_and_update(
+            {**submission_key, "linv": {"$exists": False}},
+            {"$set": {"linv": my_glory, "linv_submitted_at": now_ist}},
+            projection={"_id": 0, "finv": 1}
         )
 
-        if result.modified_count == 1:
-            starting_inventory = task.get(f"finv_{user_id}")
-            ending_inventory = my_glory
-            delta = ending_inventory - starting_inventory
-
-            # Send a message in the user's PM with the results
-            await context.bot.send_message(
-                user_id,
-                text=(
-                    f"<u>📊 Here is your inventory report:</u>\n\n"
-                    f"<b>💎 Starting Inv:</b> {starting_inventory}\n"
-                    f"<b>💎 Ending Inv:</b> {ending_inventory}\n"
-                    f"<b>🔼 Total Grind:</b> {delta}\n\n"
-                    f"<i>🙏 Thank you for participating! Please wait for the Task Result to check your reward.</i>"
-                ),
-                parse_mode=telegram.constants.ParseMode.HTML,
-            )
+        if submission is None:
+            # Rare path: find out which guard rejected the submission
+            existing = await submissions_collection.find_one(submission_key, {"_id": 1})
+            if existing:
+                await update.message.reply_text("⚠️Ending inventory has already been submitted.⚠️")
+            else:
+                await update.message.reply_text("You must submit the starting inventory first.")
+            return
 
+        starting_inventory = submission["finv"]
+        ending_inventory = my_glory
+        delta = ending_inventory - starting_inventory
 
+        # Send a message in the user's PM with the results
+        await context.bot.send_message(
+            user_id,
+            text=(
+                f"<u>📊 Here is your inventory report:</u>\n\n"
+                f"<b>💎 Starting Inv:</b> {starting_inventory}\n"
+                f"<b>💎 Ending Inv:</b> {ending_inventory}\n"
+                f"<b>🔼 Total Grind:</b> {delta}\n\n"
+                f"<i>🙏 Thank you for participating! Please wait for the Task Result to check your reward.</i>"
+            ),
+            parse_mode=telegram.constants.ParseMode.HTML,
+        )
 
-            await update.message.reply_text("Ending inventory submitted successfully.")
-        else:
-            await update.message.reply_text("Failed to submit ending inventory. Please try again.")
+        await update.message.reply_text("Ending inventory submitted successfully.")
         return
 
     else:
         await update.message.reply_text("Invalid inventory type. Use 'finv' for starting or 'linv' for ending inventory.")
 
 
-async def taskresult(chat_id: int, context: CallbackContext) -> int | None:
-    task = tasks_collection.find_one({"chat_id": chat_id, "end_time": {"$lt": datetime.now(IST)}})
-    if not task:
-        await context.bot.send_message(chat_id, "No completed task to show leaderboard for.")
-        return None
+async def get_leaderboard(task_id: str, reward_value: int) -> dict:
+    """Rank a task's participants on the server, once.
 
-    leaderboard = []
-    for key, value in task.items():
-        if key.startswith("finv_"):
-            user_id = int(key.split("_")[1])
-            finv = value
-            linv = task.get(f"linv_{user_id}")
-            if linv is not None:
-                leaderboard.append((user_id, linv - finv))
-
-    if not leaderboard:
-        await context.bot.send_message(chat_id, "No users participated in the event.")
-        return None
+    Returns {"entries": [{"user_id", "grind", "rank", "reward"}, ...] in rank
+    order, "participants": int, "total_grind": int}. Callers page through
+    `entries` in memory instead of re-running the aggregation per page.
+    """
+    pipeline = [
+        {"$match": {"task_id": task_id, "linv": {"$exists": True}}},
+        {"$project": {"_id": 0, "user_id": 1, "grind": {"$subtract": ["$linv", "$finv"]}}},
+        {"$setWindowFields": {"sortBy": {"grind": -1}, "output": {"rank": {"$rank": {}}}}},
+        {"$sort": {"rank": 1, "user_id": 1}},
+        {"$set": {"reward": {"$multiply": ["$grind", reward_value]}}},
+    ]
+    entries = await submissions_collection.aggregate(pipeline).to_list(length=None)
+    return {
+        "entries": entries,
+        "participants": len(entries),
+        "total_grind": sum(entry["grind"] for entry in entries),
+    }
 
-    leaderboard.sort(key=lambda x: x[1], reverse=True)
 
+async def _record_leaderboard(task: dict, message_id: int | None) -> None:
+    # Remembered on the task so a retried task_end job does not post it again
+    await tasks_collection.update_one({"_id": task['_id']}, {"$set": {"leaderboard_message_id": message_id}})
+
+
+async def taskresult(chat_id: int, bot: telegram.Bot, task: dict) -> int | None:
+    """Post a finished task's leaderboard and return the ID of its pinned first page.
+
+    Called by the task_end job; a task is deleted once it has run, so there
+    is no /taskresult command to show one later.
+    """
     # Extract reward from the task
     reward_value = task.get('reward_value')
     reward_type = task.get('reward_type')
     if not reward_value or not reward_type:
-        await context.bot.send_message(chat_id, "Task reward information is missing.")
+        await outbox.send_message(chat_id, "Task reward information is missing.")
+        await _record_leaderboard(task, None)
         return None
 
-    leaderboard_text = f"🏆 <b>Task Result (Reward: {reward_value} {reward_type})</b> 🏆\n\n"
-    for user_id, glory_diff in leaderboard:
-        user = await context.bot.get_chat_member(chat_id, user_id)
-        reward_amount = int(reward_value) * glory_diff
-        leaderboard_text += f"🔸 <a href='tg://user?id={user_id}'>{user.user.first_name}</a> || <code>{user_id}</code> || <code>{reward_amount}</code> {reward_type}\n\n"
+    leaderboard = await get_leaderboard(task['task_id'], int(reward_value))
+    if not leaderboard['participants']:
+        await outbox.send_message(chat_id, "No users participated in the event.")
+        await _record_leaderboard(task, None)
+        return None
 
     # Unpin the task message
+    if 'message_id' in task:
+        try:
+            await bot.unpin_chat_message(chat_id, task['message_id'])
+        except telegram.error.TelegramError as e:
+            print(f"Error while unpinning: {e}")
+
+    # Send and pin the first page with the totals, then the remaining pages
+    leaderboard_text = (
+        f"🏆 <b>Task Result (Reward: {reward_value} {reward_type})</b> 🏆\n"
+        f"👥 <b>Participants:</b> {leaderboard['participants']} || "
+        f"🔼 <b>Total Grind:</b> {leaderboard['total_grind']}\n\n"
+        + await _render_leaderboard_entries(bot, chat_id, leaderboard['entries'][:LEADERBOARD_PAGE_SIZE], reward_type)
+    )
+    message = await outbox.send_message(chat_id, leaderboard_text, parse_mode=telegram.constants.ParseMode.HTML)
+    await _record_leaderboard(task, message.message_id)
     try:
-        await context.bot.unpin_chat_message(chat_id, task['message_id'])
-    except telegram.error.BadRequest as e:
-        print(f"Error while unpinning: {e}")
-
-    # Send and pin the leaderboard message
-    message = await context.bot.send_message(chat_id, leaderboard_text, parse_mode=telegram.constants.ParseMode.HTML)
-    await context.bot.pin_chat_message(chat_id, message.message_id)
+        await bot.pin_chat_message(chat_id, message.message_id)
+    except telegram.error.TelegramError as e:
+        print(f"Error while pinning leaderboard: {e}")
+
+    pages = -(-leaderboard['participants'] // LEADERBOARD_PAGE_SIZE)
+    for page in range(1, pages):
+        entries = leaderboard['entries'][page * LEADERBOARD_PAGE_SIZE:(page + 1) * LEADERBOARD_PAGE_SIZE]
+        page_text = (
+            f"🏆 <b>Task Result ({page + 1}/{pages})</b>\n\n"
+            + await _render_leaderboard_entries(bot, chat_id, entries, reward_type)
+        )
+        await outbox.send_message(chat_id, page_text, parse_mode=telegram.constants.ParseMode.HTML)
 
     return message.message_id
 
 
+async def _render_leaderboard_entries(bot: telegram.Bot, chat_id: int, entries: list, reward_type: str) -> str:
+    names = await resolve_names(bot, chat_id, [entry['user_id'] for entry in entries])
+    text = ""
+    for entry in entries:
+        user_id = entry['user_id']
+        text += f"{entry['rank']}. 🔸 <a href='tg://user?id={user_id}'>{html.escape(names[user_id])}</a> || <code>{user_id}</code> || <code>{entry['reward']}</code> {reward_type}\n\n"
+    return text
+
+
 
 # to clear and unpin all task 
 async def clear_tasks(update: Update, context: CallbackContext) -> None:
@@ -499,7 +608,11 @@ async def clear_tasks(update: Update, context: CallbackContext) -> None:
         return
 
     chat_id = update.effective_chat.id
-    tasks_collection.delete_many({"chat_id": chat_id})
+    result = await tasks_collection.delete_many({"chat_id": chat_id})
+    await bump_counters(active_tasks=-result.deleted_count)
+    await submissions_collection.delete_many({"chat_id": chat_id})
+    await scheduler.cancel({"payload.chat_id": chat_id})
+    running_task_cache.invalidate(chat_id)
     await update.message.reply_text("All tasks have been cleared.")
     await context.bot.unpin_all_chat_messages(chat_id)
 
@@ -512,7 +625,7 @@ async def cancel_task(update: Update, context: CallbackContext) -> None:
 
     chat_id = update.effective_chat.id
     now_ist = datetime.now(IST)
-    task = tasks_collection.find_one({"chat_id": chat_id, "end_time": {"$gt": now_ist}})
+    task = await tasks_collection.find_one({"chat_id": chat_id, "end_time": {"$gt": now_ist}})
     if not task:
         await update.message.reply_text("No active task to cancel.")
         return
@@ -525,8 +638,16 @@ async def cancel_task(update: Update, context: CallbackContext) -> None:
         parse_mode=telegram.constants.ParseMode.HTML,
     )
 
-    # Delete the task from the database
-    tasks_collection.delete_one({"_id": task['_id']})
+    # Collect the participants, then delete the task and its submissions
+    submissions = await submissions_collection.find(
+        {"task_id": task['task_id']},
+        {"_id": 0, "user_id": 1, "linv": 1}
+    ).to_list(length=None)
+    result = await tasks_collection.delete_one({"_id": task['_id']})
+    await bump_counters(active_tasks=-result.deleted_count)
+    await submissions_collection.delete_many({"task_id": task['task_id']})
+    await scheduler.cancel({"_id": {"$in": [f"task_start:{task['_id']}", f"task_end:{task['_id']}"]}})
+    running_task_cache.invalidate(chat_id)
 
     # Unpin the task message
     try:
@@ -535,22 +656,19 @@ async def cancel_task(update: Update, context: CallbackContext) -> None:
         print(f"Error while unpinning: {e}")
 
     # Notify users who have submitted their inventories
-    for key in task.keys():
-        if key.startswith("finv_"):
-            user_id = int(key.split("_")[1])
-            linv_submitted = f"linv_{user_id}" in task
-
-            # Craft the message based on their submission status
-            if linv_submitted:
-                message = "The task has been canceled. You have submitted both your starting and ending inventories."
-            else:
-                message = "The task has been canceled. You have submitted your starting inventory, but not the final inventory."
+    for submission in submissions:
+        user_id = submission['user_id']
+        linv_submitted = "linv" in submission
 
-            # Send the notification in the user's private chat
-            try:
-                await context.bot.send_message(user_id, message)
-            except Exception as e:
-                print(f"Failed to notify user {user_id}: {e}")
+        # Craft the message based on their submission status
+        if linv_submitted:
+            message = "The task has been canceled. You have submitted both your starting and ending inventories."
+        else:
+            message = "The task has been canceled. You have submitted your starting inventory, but not the final inventory."
+
+        # Queue the notification for the user's private chat; the outbox paces
+        # the DMs and retries rate-limited ones without holding up this reply
+        await outbox.send_message(user_id, message, priority=BULK, wait=False)
 
     await update.message.reply_text("The task has been canceled successfully, and users have been notified.")
 
@@ -559,13 +677,13 @@ async def cancel_task(update: Update, context: CallbackContext) -> None:
 @require_verification
 async def check_current_tasks(update: Update, context: CallbackContext) -> None:
     # Check if the user is a sudo or owner
-    if not await is_owner_or_sudo(update):  # Pass the Update object
+    if not is_owner_or_sudo(update):  # Pass the Update object
         await update.message.reply_text("None")
         return
 
     # Fetch all active tasks from the database
     now_ist = datetime.now(IST)
-    tasks = list(tasks_collection.find({"end_time": {"$gt": now_ist}}))
+    tasks = await tasks_collection.find({"end_time": {"$gt": now_ist}}).to_list(length=None)
 
     # If no active tasks exist
     if not tasks:
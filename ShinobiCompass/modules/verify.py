@@ -1,9 +1,14 @@
 from telegram import Update
 from telegram.ext import CallbackContext, ContextTypes
 from ShinobiCompass.database import db  # Adjusted database import
+from ShinobiCompass.cache import TTLCache
+from ShinobiCompass.counters import bump_counters
+from ShinobiCompass.outbox import outbox
 from ShinobiCompass.modules.sudo import is_owner_or_sudo
 from functools import wraps
+from pymongo import ReturnDocument
 import logging
+import os
 import pytz
 import re
 from datetime import datetime, timedelta
@@ -13,6 +18,44 @@ logger = logging.getLogger(__name__)
 
 CHANNEL_ID = -1002254557222  # Your channel ID for notifications
 
+# Projection of the profile fields shown in the channel posts and /info
+PROFILE_PROJECTION = {"_id": 0, "user_id": 1, "name": 1, "clan": 1, "level": 1, "username": 1, "verified": 1, "message_id": 1}
+
+# In-process cache of verification results, keyed by user ID. Every change
+# bumps a version counter in `settings`; other replicas poll it and drop
+# their cache when it moves, as for the sudo users.
+VERIFY_CACHE_SIZE = int(os.getenv("VERIFY_CACHE_SIZE", "10000"))
+VERIFY_CACHE_TTL = int(os.getenv("VERIFY_CACHE_TTL", "300"))  # seconds
+VERIFY_REFRESH_INTERVAL = int(os.getenv("VERIFY_REFRESH_INTERVAL", "15"))  # seconds
+verification_cache = TTLCache(maxsize=VERIFY_CACHE_SIZE, ttl=VERIFY_CACHE_TTL)
+_verification_version = None
+
+async def _read_verification_version():
+    doc = await db.settings.find_one({"_id": "verification_version"}, {"version": 1})
+    return doc["version"] if doc else 0
+
+async def invalidate_verification(user_id: int) -> None:
+    """Drop the cached verification result for a user here and on the other replicas."""
+    global _verification_version
+    verification_cache.invalidate(user_id)
+    doc = await db.settings.find_one_and_update(
+        {"_id": "verification_version"},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    # Skip our own bump, but not one from another replica that came in between
+    if _verification_version is not None and doc["version"] == _verification_version + 1:
+        _verification_version = doc["version"]
+
+async def refresh_verification_cache() -> None:
+    """Drop the whole cache when another replica changed a verification."""
+    global _verification_version
+    version = await _read_verification_version()
+    if version != _verification_version:
+        verification_cache.clear()
+        _verification_version = version
+
 # Function to get sudo users collection
 async def get_sudo_users_collection():
     if db is not None:
@@ -32,8 +75,18 @@ async def get_users_collection():
 # Function to check if the user is verified
 async def is_verified(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
+
+    # Serve repeated checks from the in-process cache
+    cached = verification_cache.get(user_id)
+    if cached is not None:
+        return cached
+
     logger.info(f"Checking verification for user ID: {user_id}")
+    result = await _load_verification(user_id)
+    verification_cache.set(user_id, result)
+    return result
 
+async def _load_verification(user_id: int):
     # Get the users collection directly from db
     users_collection = await get_users_collection()
     if users_collection is None:
@@ -41,7 +94,7 @@ async def is_verified(update: Update, context: CallbackContext):
         return False
 
     # Check if the user exists in the database
-    user_data = users_collection.find_one({"user_id": user_id})
+    user_data = await users_collection.find_one({"user_id": user_id}, {"verified": 1})
     if not user_data:
         logger.info(f"User ID: {user_id} not found in the database.")
         return False
@@ -96,7 +149,7 @@ async def verify_user(update: Update, context: CallbackContext) -> None:
     try:
 
         # Check if the user is already verified
-        user = db.users.find_one({"user_id": user_id})
+        user = await db.users.find_one({"user_id": user_id}, {"verified": 1})
         if user and user.get("verified", False):
             await update.message.reply_text("✅ You are already verified. No need to verify again.")
             return
@@ -169,10 +222,10 @@ async def verify_user(update: Update, context: CallbackContext) -> None:
             clan = None
 
         # Check if the clan is authorized
-        clan_auth = db.clans.find_one({"name": clan, "authorized": True}) if clan else None
+        clan_auth = await db.clans.find_one({"name": clan, "authorized": True}, {"_id": 1}) if clan else None
 
         # Update the user's data in the database
-        result = db.users.find_one_and_update(
+        result = await db.users.find_one_and_update(
             {"user_id": user_id},
             {
                 "$set": {
@@ -184,8 +237,17 @@ async def verify_user(update: Update, context: CallbackContext) -> None:
                     "username": username
                 }
             },
+            projection={"message_id": 1, "verified": 1},
             upsert=True,
-            return_document=True
+            return_document=ReturnDocument.BEFORE
+        )
+        await invalidate_verification(user_id)
+
+        # The previous document tells whether this is a new user or a verification change
+        was_verified = bool(result and result.get("verified"))
+        await bump_counters(
+            users=0 if result else 1,
+            verified_users=int(clan_auth is not None) - int(was_verified)
         )
 
         # Prepare the channel message content
@@ -204,7 +266,7 @@ async def verify_user(update: Update, context: CallbackContext) -> None:
         # Edit or send the channel message
         if result and "message_id" in result:
             # Edit the existing message
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
                 chat_id=CHANNEL_ID,
                 message_id=result["message_id"],
                 text=channel_message,
@@ -212,13 +274,13 @@ async def verify_user(update: Update, context: CallbackContext) -> None:
             )
         else:
             # Send a new message to the channel
-            sent_message = await context.bot.send_message(
+            sent_message = await outbox.send_message(
                 chat_id=CHANNEL_ID,
                 text=channel_message,
                 parse_mode="HTML"
             )
             # Save the message ID in the database
-            db.users.update_one(
+            await db.users.update_one(
                 {"user_id": user_id},
                 {"$set": {"message_id": sent_message.message_id}}
             )
@@ -244,7 +306,7 @@ async def verify_user(update: Update, context: CallbackContext) -> None:
 async def auth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     """Authorize a clan or a user."""
-    if not await is_owner_or_sudo(update):
+    if not is_owner_or_sudo(update):
         await update.message.reply_text("⚠️ Only owners or sudo users can perform this action.")
         return
 
@@ -257,13 +319,15 @@ async def auth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Check if the input is numeric (user ID)
     if input_value.isdigit():
         user_id = int(input_value)
-        user = db.users.find_one({"user_id": user_id})
+        user = await db.users.find_one({"user_id": user_id}, PROFILE_PROJECTION)
 
         if not user:
             await update.message.reply_text(f"⚠️ User ID {user_id} not found in the database.")
             return
 
-        db.users.update_one({"user_id": user_id}, {"$set": {"verified": True}})
+        result = await db.users.update_one({"user_id": user_id, "verified": {"$ne": True}}, {"$set": {"verified": True}})
+        await bump_counters(verified_users=result.modified_count)
+        await invalidate_verification(user_id)
 
         # Preserve the original username from the database for the link
         original_username = user.get("username", "NoUsername")
@@ -281,7 +345,7 @@ async def auth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 f"✅ <b>Verified:</b> Yes"
             )
 
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
                 chat_id=CHANNEL_ID,
                 message_id=user["message_id"],
                 text=channel_message,
@@ -295,7 +359,7 @@ async def auth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             await update.message.reply_text(f"✅ Clan '{input_value}' is already authorized by default.")
             return
 
-        db.clans.update_one({"name": input_value}, {"$set": {"authorized": True}}, upsert=True)
+        await db.clans.update_one({"name": input_value}, {"$set": {"authorized": True}}, upsert=True)
         await update.message.reply_text(f"✅ Clan '{input_value}' has been authorized.")
 
 
@@ -303,7 +367,7 @@ async def auth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def unauth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     """Unauthorize a clan or a user."""
-    if not await is_owner_or_sudo(update):
+    if not is_owner_or_sudo(update):
         await update.message.reply_text("⚠️ Only owners or sudo users can perform this action.")
         return
 
@@ -316,13 +380,15 @@ async def unauth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Check if the input is numeric (user ID)
     if input_value.isdigit():
         user_id = int(input_value)
-        user = db.users.find_one({"user_id": user_id})
+        user = await db.users.find_one({"user_id": user_id}, PROFILE_PROJECTION)
 
         if not user:
             await update.message.reply_text(f"⚠️ User ID {user_id} not found in the database.")
             return
 
-        db.users.update_one({"user_id": user_id}, {"$set": {"verified": False}})
+        result = await db.users.update_one({"user_id": user_id, "verified": True}, {"$set": {"verified": False}})
+        await bump_counters(verified_users=-result.modified_count)
+        await invalidate_verification(user_id)
 
         # Preserve the original username from the database for the link
         original_username = user.get("username", "NoUsername")
@@ -340,7 +406,7 @@ async def unauth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 f"✅ <b>Verified:</b> No"
             )
 
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
                 chat_id=CHANNEL_ID,
                 message_id=user["message_id"],
                 text=channel_message,
@@ -356,13 +422,13 @@ async def unauth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             )
             return
 
-        db.clans.update_one({"name": input_value}, {"$set": {"authorized": False}})
+        await db.clans.update_one({"name": input_value}, {"$set": {"authorized": False}})
         await update.message.reply_text(f"✅ Clan '{input_value}' has been unauthorized.")
 
 
 async def info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Display information about a user."""
-    if not await is_owner_or_sudo(update):
+    if not is_owner_or_sudo(update):
         await update.message.reply_text("⚠️ Only owners or sudo users can view user info.")
         return
 
@@ -372,7 +438,7 @@ async def info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     try:
         user_id = int(context.args[0])  # Convert argument to integer for user ID
-        user = db.users.find_one({"user_id": user_id})  # Ensure the correct field name `user_id`
+        user = await db.users.find_one({"user_id": user_id}, PROFILE_PROJECTION)  # Ensure the correct field name `user_id`
         if not user:
             await update.message.reply_text(f"⚠️ No user found with ID {user_id}.")
             return
@@ -0,0 +1,292 @@
+"""Central outbound queue for Telegram API calls.
+
+Every bulk or fan-out send goes through `outbox` so the bot stays within
+Telegram's limits instead of running into 429s:
+
+- a global token bucket (about 30 messages per second),
+- a bucket per private chat (about 1 per second) and per group or channel
+  (about 20 per minute),
+- two priority lanes: INTERACTIVE replies are dispatched ahead of BULK
+  notifications such as DMs and broadcasts,
+- RetryAfter errors pause the chat for the requested delay and retry the call.
+
+Each chat has its own FIFO queue with its bucket, and at most one call per
+chat is in flight, so messages to a chat are delivered in the order they
+were queued, retries included. A single dispatcher loop picks the next ready
+chat by the priority of its oldest call; chats that are out of tokens or
+paused wait on a timer, so a busy chat never holds up the others.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque
+
+from telegram.error import RetryAfter
+
+from ShinobiCompass.background import cancel_and_wait
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes (lower runs first)
+INTERACTIVE = 0
+BULK = 1
+
+GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))  # calls per second
+PRIVATE_CHAT_RATE = 1.0  # calls per second
+GROUP_CHAT_RATE = 20 / 60  # calls per second
+GROUP_CHAT_BURST = 20
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "16"))  # calls in flight
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "5"))
+IDLE_SWEEP_INTERVAL = 60  # seconds between sweeps of idle chat queues
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self, now: float | None = None) -> float:
+        """Take a token and return 0, or return the seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Empty the bucket so no token is available for `seconds`."""
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+        self.updated = time.monotonic()
+
+
+class _Call:
+    __slots__ = ("chat_id", "method", "kwargs", "priority", "future", "enqueued_at", "attempts")
+
+    def __init__(self, chat_id: int, method: str, kwargs: dict, priority: int):
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+class _ChatQueue:
+    """Pending calls for one chat, in order, with the chat's rate limit state."""
+
+    __slots__ = ("bucket", "calls", "paused_until", "scheduled", "sending")
+
+    def __init__(self, chat_id: int):
+        if chat_id < 0:
+            self.bucket = TokenBucket(GROUP_CHAT_RATE, GROUP_CHAT_BURST)
+        else:
+            self.bucket = TokenBucket(PRIVATE_CHAT_RATE, 1)
+        self.calls = deque()
+        self.paused_until = 0.0
+        self.scheduled = False  # In the ready queue or waiting on a timer
+        self.sending = False  # A call for this chat is in flight
+
+    def is_idle(self, now: float) -> bool:
+        """True when dropping this queue loses nothing: no calls, no pause, full bucket."""
+        if self.calls or self.sending or self.scheduled or self.paused_until > now:
+            return False
+        tokens = self.bucket.tokens + (now - self.bucket.updated) * self.bucket.rate
+        return tokens >= self.bucket.capacity
+
+
+class Outbox:
+    def __init__(self):
+        self.bot = None
+        self._chats: dict[int, _ChatQueue] = {}
+        self._ready = asyncio.PriorityQueue()  # (priority of the chat's oldest call, seq, chat_id)
+        self._timers = []  # (ready_at, seq, chat_id) for chats that are throttled or paused
+        self._seq = itertools.count()
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._slots = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+        self._in_flight = set()
+        self._loop_task = None
+        self._last_sweep = time.monotonic()
+        self._queued = 0
+
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def start(self, application) -> None:
+        self.bot = application.bot
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        await cancel_and_wait([self._loop_task, *self._in_flight])
+        self._loop_task = None
+
+    async def call(self, chat_id: int, method: str, priority: int = INTERACTIVE, wait: bool = True, **kwargs):
+        """Queue `bot.<method>(chat_id=chat_id, **kwargs)`.
+
+        With `wait=True` the result is returned (or the error raised) once the
+        call has been made; otherwise the call is fire-and-forget and failures
+        are only logged.
+        """
+        call = _Call(chat_id, method, kwargs, priority)
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatQueue(chat_id)
+        chat.calls.append(call)
+        self._queued += 1
+        self._schedule(chat_id, chat)
+        if wait:
+            return await call.future
+        call.future.add_done_callback(self._log_failure)
+        return call.future
+
+    async def send_message(self, chat_id: int, text: str, priority: int = INTERACTIVE, wait: bool = True, **kwargs):
+        return await self.call(chat_id, "send_message", priority, wait, text=text, **kwargs)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, priority: int = INTERACTIVE, wait: bool = True, **kwargs):
+        return await self.call(chat_id, "edit_message_text", priority, wait, message_id=message_id, text=text, **kwargs)
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.debug(f"Queued Telegram call failed: {future.exception()}")
+
+    def _schedule(self, chat_id: int, chat: _ChatQueue, delay: float = 0.0) -> None:
+        """Make the chat eligible for dispatch now, or after `delay` seconds."""
+        if chat.scheduled or chat.sending or not chat.calls:
+            return
+        chat.scheduled = True
+        if delay > 0:
+            heapq.heappush(self._timers, (time.monotonic() + delay, next(self._seq), chat_id))
+        else:
+            self._ready.put_nowait((chat.calls[0].priority, next(self._seq), chat_id))
+
+    def _sweep_idle(self, now: float) -> None:
+        # Only chats that would come back identical are dropped, so limits are never reset
+        for chat_id in [chat_id for chat_id, chat in self._chats.items() if chat.is_idle(now)]:
+            del self._chats[chat_id]
+        self._last_sweep = now
+
+    async def _next_chat(self) -> int:
+        """Wait for the next chat that may send, releasing timers as they expire."""
+        while True:
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._timers)
+                chat = self._chats.get(chat_id)
+                if chat is not None and chat.calls:
+                    self._ready.put_nowait((chat.calls[0].priority, next(self._seq), chat_id))
+                elif chat is not None:
+                    chat.scheduled = False
+            if now - self._last_sweep >= IDLE_SWEEP_INTERVAL:
+                self._sweep_idle(now)
+
+            timeout = IDLE_SWEEP_INTERVAL
+            if self._timers:
+                timeout = min(timeout, self._timers[0][0] - now)
+            try:
+                _, _, chat_id = await asyncio.wait_for(self._ready.get(), timeout=timeout)
+                return chat_id
+            except asyncio.TimeoutError:
+                continue
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                chat_id = await self._next_chat()
+                chat = self._chats[chat_id]
+                chat.scheduled = False
+
+                # Drop calls whose caller gave up
+                while chat.calls and chat.calls[0].future.done():
+                    chat.calls.popleft()
+                    self._queued -= 1
+                if not chat.calls:
+                    continue
+
+                # The chat's own limit: wait on a timer rather than blocking other chats
+                now = time.monotonic()
+                delay = chat.paused_until - now
+                if delay <= 0:
+                    delay = chat.bucket.try_acquire(now)
+                if delay > 0:
+                    self._schedule(chat_id, chat, delay)
+                    continue
+
+                # The global limit applies to everyone, so just wait for it
+                while (delay := self._global.try_acquire()):
+                    await asyncio.sleep(delay)
+
+                await self._slots.acquire()
+                call = chat.calls.popleft()
+                self._queued -= 1
+                chat.sending = True
+                task = asyncio.create_task(self._send(chat, call))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox loop error: {e}", exc_info=True)
+
+    async def _send(self, chat: _ChatQueue, call: _Call) -> None:
+        try:
+            call.attempts += 1
+            result = await getattr(self.bot, call.method)(chat_id=call.chat_id, **call.kwargs)
+        except RetryAfter as e:
+            if call.attempts > OUTBOX_MAX_RETRIES:
+                self.failed += 1
+                if not call.future.done():
+                    call.future.set_exception(e)
+                return
+            # Telegram told us how long to back off: pause the chat and retry
+            # this call first, so the chat's order is kept
+            self.retries += 1
+            chat.paused_until = time.monotonic() + e.retry_after
+            chat.calls.appendleft(call)
+            self._queued += 1
+            logger.warning(f"Rate limited on chat {call.chat_id}, retrying in {e.retry_after}s.")
+        except Exception as e:
+            self.failed += 1
+            if not call.future.done():
+                call.future.set_exception(e)
+        else:
+            latency = time.monotonic() - call.enqueued_at
+            self.sent += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if not call.future.done():
+                call.future.set_result(result)
+        finally:
+            self._slots.release()
+            chat.sending = False
+            self._schedule(call.chat_id, chat)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queued,
+            "parked": len(self._timers),
+            "in_flight": len(self._in_flight),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "avg_latency_ms": (self.total_latency / self.sent * 1000) if self.sent else 0.0,
+            "max_latency_ms": self.max_latency * 1000,
+        }
+
+
+outbox = Outbox()
@@ -0,0 +1,305 @@
+"""Persistent job scheduler.
+
+Jobs are stored in the `scheduled_jobs` collection, so pending work survives
+restarts and deploys. Each process keeps a min-heap of (run_at, job_id)
+entries and a single loop that sleeps exactly until the head of the heap is
+due, then claims every job due in that tick atomically (so only one replica
+runs it) and dispatches them together. Jobs that fell due while the bot was
+down are picked up as soon as the loop starts. Jobs scheduled with the same
+`group` (e.g. one chat) never run concurrently and run in `run_at` order, so
+a catch-up batch cannot race a task's start against its end.
+
+A claim is a lease: a job whose runner died mid-run goes back to the queue
+once its lease expires, which every replica checks on each sync. Failed jobs
+are retried with exponential backoff up to SCHEDULER_MAX_ATTEMPTS times.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from ShinobiCompass.background import cancel_and_wait
+from ShinobiCompass.database import db
+
+logger = logging.getLogger(__name__)
+
+jobs_collection = db["scheduled_jobs"]
+
+POLL_INTERVAL = int(os.getenv("SCHEDULER_POLL_INTERVAL", "60"))  # seconds, resync with other replicas
+TICK = 0.05  # Jobs due within the same 50 ms are dispatched as one batch
+CLAIM_LEASE = timedelta(seconds=int(os.getenv("SCHEDULER_LEASE_SECONDS", "300")))  # Re-run jobs whose runner died
+MAX_ATTEMPTS = int(os.getenv("SCHEDULER_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = 30  # seconds, doubled after every failed attempt
+RETRY_MAX_DELAY = 60 * 60
+
+# Registered job handlers: kind -> async def handler(bot, payload)
+_handlers = {}
+
+
+def job_handler(kind: str):
+    """Register the coroutine that runs jobs of the given kind."""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def _utc(value: datetime) -> datetime:
+    """Normalize to naive UTC, the form MongoDB returns."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class Scheduler:
+    def __init__(self):
+        self.bot = None
+        self._heap = []  # (run_at, seq, job_id, group); payloads stay in MongoDB
+        self._queued = set()
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._loop_task = None
+        self._last_sync = None
+        self._running = set()
+        self._claimed = set()  # Jobs this process has claimed and not finished
+        self._group_locks = {}  # group -> [lock, jobs holding or waiting for it]
+
+        # Metrics
+        self.executed = 0
+        self.failed = 0
+        self.batches = 0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def _push(self, job_id, run_at: datetime, group=None) -> None:
+        if job_id in self._queued:
+            return
+        self._queued.add(job_id)
+        heapq.heappush(self._heap, (run_at, next(self._seq), job_id, group))
+
+    async def schedule(self, kind: str, run_at: datetime, payload: dict, job_id: str | None = None, group=None) -> str:
+        """Persist a job to run at `run_at`.
+
+        Re-scheduling a job_id that is still pending or running is logged and
+        ignored; one that failed for good is replaced. Jobs sharing a `group`
+        run one at a time, in `run_at` order.
+        """
+        job = {
+            "kind": kind,
+            "run_at": _utc(run_at),
+            "group": group,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": datetime.utcnow(),
+            "queued_at": datetime.utcnow(),
+        }
+        if job_id is not None:
+            job["_id"] = job_id
+        try:
+            result = await jobs_collection.insert_one(job)
+            job_id = result.inserted_id
+        except DuplicateKeyError:
+            result = await jobs_collection.replace_one({"_id": job_id, "status": "failed"}, job)
+            if not result.matched_count:
+                logger.warning(f"Job {job_id} is already scheduled; keeping the existing one.")
+                return job_id
+
+        # Only wake the loop if the new job is now the earliest one
+        self._push(job_id, job["run_at"], group)
+        if self._heap[0][2] == job_id:
+            self._wakeup.set()
+        return job_id
+
+    async def cancel(self, query: dict) -> int:
+        """Delete pending jobs matching `query`.
+
+        Their heap entries are dropped lazily: claiming a deleted job fails.
+        """
+        result = await jobs_collection.delete_many({**query, "status": "pending"})
+        return result.deleted_count
+
+    async def start(self, application) -> None:
+        """Rehydrate persisted jobs and start the timer loop."""
+        self.bot = application.bot
+
+        await self._reclaim_expired()
+        await self._sync(full=True)
+        overdue = sum(1 for run_at, *_ in self._heap if run_at <= datetime.utcnow())
+        if overdue:
+            logger.info(f"Catching up on {overdue} scheduled jobs missed while offline.")
+
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the loop, cancel running jobs and hand their claims back."""
+        await cancel_and_wait([self._loop_task, *self._running])
+        self._loop_task = None
+        if self._claimed:
+            # Interrupted runs do not count as attempts; the next start runs them again
+            await jobs_collection.update_many(
+                {"_id": {"$in": list(self._claimed)}, "status": "running"},
+                {"$set": {"status": "pending", "queued_at": datetime.utcnow()}, "$inc": {"attempts": -1}}
+            )
+            self._claimed.clear()
+
+    async def _reclaim_expired(self) -> None:
+        """Put jobs whose claim lease expired back in the queue."""
+        now = datetime.utcnow()
+        result = await jobs_collection.update_many(
+            {"status": "running", "lease_until": {"$lt": now}},
+            {"$set": {"status": "pending", "queued_at": now}}
+        )
+        if result.modified_count:
+            logger.warning(f"Re-queued {result.modified_count} scheduled jobs whose runner stopped.")
+
+    async def _sync(self, full: bool = False) -> None:
+        """Load pending jobs (including ones scheduled by other replicas) into the heap."""
+        query = {"status": "pending"}
+        if not full:
+            # Only jobs (re)queued since the last sync, with some slack for clock skew
+            await self._reclaim_expired()
+            query["queued_at"] = {"$gte": self._last_sync - timedelta(seconds=POLL_INTERVAL)}
+        self._last_sync = datetime.utcnow()
+        cursor = jobs_collection.find(query, {"run_at": 1, "group": 1})
+        async for job in cursor:
+            self._push(job["_id"], job["run_at"], job.get("group"))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                now = datetime.utcnow()
+                if (now - self._last_sync).total_seconds() >= POLL_INTERVAL:
+                    await self._sync()
+
+                # Pop every job due in this tick and run them as one batch
+                due = []
+                horizon = now + timedelta(seconds=TICK)
+                while self._heap and self._heap[0][0] <= horizon:
+                    run_at, _, job_id, group = heapq.heappop(self._heap)
+                    self._queued.discard(job_id)
+                    due.append((job_id, run_at, group))
+                if due:
+                    # Run the batch in the background so the timer stays on schedule
+                    self.batches += 1
+                    batch = asyncio.create_task(self._run_batch(due))
+                    self._running.add(batch)
+                    batch.add_done_callback(self._running.discard)
+                    continue
+
+                delay = POLL_INTERVAL
+                if self._heap:
+                    delay = min((self._heap[0][0] - now).total_seconds(), POLL_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scheduler loop error: {e}", exc_info=True)
+                delay = POLL_INTERVAL
+
+            # Sleep until the next job is due or an earlier job is scheduled
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_batch(self, due: list) -> None:
+        # `due` is in run_at order, and the group locks queue waiters in
+        # arrival order, so jobs of one group also run in run_at order
+        await asyncio.gather(*(self._execute_in_group(*entry) for entry in due), return_exceptions=True)
+
+    async def _execute_in_group(self, job_id, run_at: datetime, group) -> None:
+        if group is None:
+            return await self._execute(job_id, run_at)
+
+        entry = self._group_locks.setdefault(group, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._execute(job_id, run_at)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._group_locks[group]
+
+    async def _execute(self, job_id, run_at: datetime) -> None:
+        # Claim the job; another replica may have taken it, or it was canceled
+        now = datetime.utcnow()
+        job = await jobs_collection.find_one_and_update(
+            {"_id": job_id, "status": "pending", "run_at": {"$lte": now + timedelta(seconds=TICK)}},
+            {"$set": {"status": "running", "claimed_at": now, "lease_until": now + CLAIM_LEASE}, "$inc": {"attempts": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None:
+            return
+        self._claimed.add(job_id)
+        try:
+            await self._run_job(job, run_at)
+        except asyncio.CancelledError:
+            raise  # Still claimed: stop() hands it back
+        except Exception:
+            self._claimed.discard(job_id)  # The lease expires and the job is re-queued
+            raise
+        self._claimed.discard(job_id)
+
+    async def _run_job(self, job: dict, run_at: datetime) -> None:
+        job_id = job["_id"]
+
+        lateness = max((datetime.utcnow() - run_at).total_seconds(), 0.0)
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+
+        handler = _handlers.get(job["kind"])
+        if handler is None:
+            logger.error(f"No handler registered for job kind '{job['kind']}'.")
+            self.failed += 1
+            await jobs_collection.update_one({"_id": job_id}, {"$set": {"status": "failed", "error": "no handler"}})
+            return
+
+        try:
+            await handler(self.bot, job["payload"])
+        except Exception as e:
+            logger.error(f"Job {job_id} ({job['kind']}) failed: {e}", exc_info=True)
+            self.failed += 1
+            await self._retry_or_fail(job, str(e))
+            return
+
+        self.executed += 1
+        await jobs_collection.delete_one({"_id": job_id})
+
+    async def _retry_or_fail(self, job: dict, error: str) -> None:
+        attempts = job.get("attempts", 1)
+        if attempts >= MAX_ATTEMPTS:
+            await jobs_collection.update_one({"_id": job["_id"]}, {"$set": {"status": "failed", "error": error}})
+            return
+
+        # Exponential backoff: 30s, 60s, 120s, ... capped at an hour
+        delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+        now = datetime.utcnow()
+        run_at = now + timedelta(seconds=delay)
+        await jobs_collection.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": "pending", "run_at": run_at, "queued_at": now, "error": error}}
+        )
+        self._push(job["_id"], run_at, job.get("group"))
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        runs = self.executed + self.failed
+        return {
+            "queue_depth": len(self._heap),
+            "next_due_in": (self._heap[0][0] - datetime.utcnow()).total_seconds() if self._heap else None,
+            "executed": self.executed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "avg_lateness_ms": (self.total_lateness / runs * 1000) if runs else 0.0,
+            "max_lateness_ms": self.max_lateness * 1000,
+        }
+
+
+scheduler = Scheduler()
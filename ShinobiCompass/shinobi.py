@@ -0,0 +1,59 @@
+"""Shinobi names and a matcher that finds them in free text.
+
+Names are matched as whole words, so short names such as "A", "Ay" or "Mu"
+only match when they appear as a word of their own. Every name is indexed
+by its token tuple when the module is imported, and a lookup tries the
+longest name first at each word of the text. That is linear in the length
+of the text, whatever the number of names.
+"""
+import re
+
+# Shinobi classifications
+LEGENDARY_SHINOBIS = [
+    "Shisui Uchiha", "Tsunade Senju", "Gaara", "Jiraiya", "Hiruzen Sarutobi",
+    "Orochimaru", "Might Guy", "Kakashi Hatake", "Itachi Uchiha", "Minato Namikaze",
+    "Madara Uchiha", "Hashirama Senju", "Tobirama Senju", "Mu", "Onoki",
+    "Gengetsu Hozuki", "A", "Ay", "Mei Terumi", "Rasa",
+]
+NON_LEGENDARY_SHINOBIS = [
+    "Ino Yamanaka", "Choji Akimichi", "Shikamaru Nara", "Rock Lee", "Neji Hyuga",
+    "Ten Ten", "Sakura Haruno", "Hinata Hyuga", "Kiba Inuzuka", "Shino Aburame",
+    "Kankuro", "Temari", "Asuma", "Konohamaru", "Iruka Umino", "Sai", "Rin Nohara",
+    "Hanabi Hyuga", "Kurenai Yuhi", "Kushina Uzumaki",
+]
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _tokens(text: str) -> tuple[str, ...]:
+    return tuple(_WORD_RE.findall(text.lower()))
+
+
+class ShinobiMatcher:
+    """Whole-word lookup of known shinobi names in a line of text."""
+
+    def __init__(self, legendary: list[str], non_legendary: list[str]):
+        # Token tuple -> (name, is_legendary)
+        self._index = {}
+        for names, is_legendary in ((legendary, True), (non_legendary, False)):
+            for name in names:
+                self._index[_tokens(name)] = (name, is_legendary)
+        self._max_words = max(len(key) for key in self._index)
+
+    def match(self, text: str) -> tuple[str, bool] | None:
+        """Return (name, is_legendary) for the first shinobi named in `text`, or None."""
+        words = _tokens(text)
+        for start in range(len(words)):
+            for length in range(min(self._max_words, len(words) - start), 0, -1):
+                found = self._index.get(words[start:start + length])
+                if found:
+                    return found
+        return None
+
+
+shinobi_matcher = ShinobiMatcher(LEGENDARY_SHINOBIS, NON_LEGENDARY_SHINOBIS)
+
+
+def match_shinobi(text: str) -> tuple[str, bool] | None:
+    """Return (name, is_legendary) for the first shinobi named in `text`, or None."""
+    return shinobi_matcher.match(text)
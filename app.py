@@ -1,34 +1,51 @@
 import logging
 import os
-from pymongo import MongoClient
 from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters,
 )
 
 # Import custom 
-from ShinobiCompass.modules.start import start, help_callback_handler, empty_update, back_to_main, help_extra, show_updates_callback, update_message
-from ShinobiCompass.modules.bm import bm, handle_message
-from ShinobiCompass.modules.sudo import addsudo, removesudo, sudolist
-from ShinobiCompass.modules.stats import stats, handle_stats_buttons
+from ShinobiCompass.database import connect_mongo, close_mongo_connection
+from ShinobiCompass.indexes import ensure_indexes
+from ShinobiCompass.background import start_periodic, stop_periodic
+from ShinobiCompass.counters import ensure_counters, reconcile_counters, COUNTERS_RECONCILE_INTERVAL
+from ShinobiCompass.scheduler import scheduler
+from ShinobiCompass.outbox import outbox
+from ShinobiCompass.market import load_offer_history, flush_offers, OFFER_FLUSH_INTERVAL
+from ShinobiCompass.modules.start import start, help_callback_handler, empty_update, back_to_main, help_extra, show_updates_callback, update_message, load_update_message, refresh_update_message, UPDATE_MESSAGE_REFRESH_INTERVAL
+from ShinobiCompass.modules.bm import bm, handle_message, black_market_filter
+from ShinobiCompass.modules.sudo import addsudo, removesudo, sudolist, load_sudo_users, refresh_sudo_users, SUDO_REFRESH_INTERVAL
+from ShinobiCompass.modules.stats import stats, handle_stats_buttons, perf_stats
 from ShinobiCompass.modules.task import (
     set_task,
     clear_tasks,
     submit_inventory,
-    taskresult,
     cancel_task,
     check_current_tasks,
 )
 # from ShinobiCompass.modules.pawn import ( )
 
 from ShinobiCompass.modules.extra import xp_command, iseal_command, calc, luck
-from ShinobiCompass.modules.flood import floods, set_constants
-from ShinobiCompass.modules.verify import verify_user, auth, unauth, info
+from ShinobiCompass.modules.flood import (
+    floods,
+    set_constants,
+    flood_guard,
+    flood_engine,
+    load_flood_constants,
+    migrate_legacy_rate_state,
+    refresh_flood_constants,
+    FLOOD_CONSTANTS_REFRESH_INTERVAL,
+)
+from ShinobiCompass.modules.verify import verify_user, auth, unauth, info, refresh_verification_cache, VERIFY_REFRESH_INTERVAL
 from ShinobiCompass.modules.call import reply
+from ShinobiCompass.modules.broadcast import broadcast, resume_broadcasts, stop_broadcasts, BROADCAST_RESUME_INTERVAL
+from ShinobiCompass.modules.directory import remember_user, flush_directory, DIRECTORY_FLUSH_INTERVAL
 
 
 # Logging setup
@@ -44,28 +61,68 @@ if not OWNER_ID:
     raise ValueError("OWNER_ID is not set")
 SUDO_USERS_COLLECTION = "sudo_users"  # MongoDB collection for sudo users
 
-# MongoDB setup
-MONGO_URI = os.getenv("MONGO_URI")
-if not MONGO_URI:
-    raise ValueError("MONGO_URI is not set")
-client = MongoClient(MONGO_URI)
 
-try:
-    client.admin.command('ping')
-    logger.info("Connected to MongoDB successfully!")
-except Exception as e:
-    logger.error(f"Failed to connect to MongoDB: {e}")
-    raise
+# Startup / shutdown hooks
+async def on_startup(application):
+    # Open the shared MongoDB pool owned by ShinobiCompass.database
+    await connect_mongo()
+    await ensure_indexes()
+
+    # Warm in-memory state and keep it in sync with other replicas
+    await load_sudo_users()
+    await refresh_verification_cache()
+    await load_update_message()
+    await migrate_legacy_rate_state()
+    await load_flood_constants()
+    await flood_engine.load_blocks()
+    await ensure_counters()
+    await load_offer_history()
+    start_periodic(60 * 60, flood_engine.prune, "flood state prune")
+    start_periodic(DIRECTORY_FLUSH_INTERVAL, flush_directory, "user directory flush")
+    start_periodic(OFFER_FLUSH_INTERVAL, flush_offers, "offer history flush")
+
+    # Start the outbound send queue before anything can send through it
+    outbox.start(application)
+
+    # Rehydrate persisted task jobs and start the scheduler loop
+    await scheduler.start(application)
+    await resume_broadcasts()
+    start_periodic(BROADCAST_RESUME_INTERVAL, resume_broadcasts, "broadcast resume")
+    start_periodic(SUDO_REFRESH_INTERVAL, refresh_sudo_users, "sudo refresh")
+    start_periodic(VERIFY_REFRESH_INTERVAL, refresh_verification_cache, "verification cache refresh")
+    start_periodic(UPDATE_MESSAGE_REFRESH_INTERVAL, refresh_update_message, "update message refresh")
+    start_periodic(FLOOD_CONSTANTS_REFRESH_INTERVAL, refresh_flood_constants, "flood constants refresh")
+    start_periodic(COUNTERS_RECONCILE_INTERVAL, reconcile_counters, "counters reconciliation")
+
+
+async def on_shutdown(application):
+    await stop_periodic()
+    await stop_broadcasts()
+    await scheduler.stop()
+    await outbox.stop()
+    await flush_directory()
+    await flush_offers()
+    close_mongo_connection()
 
-db = client.get_database("Tgbotproject")
 
 # Telegram bot setup
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN is not set")
-application = ApplicationBuilder().token(BOT_TOKEN).build()
+application = (
+    ApplicationBuilder()
+    .token(BOT_TOKEN)
+    .post_init(on_startup)
+    .post_shutdown(on_shutdown)
+    .build()
+)
 
 # Add handlers
+# Record every sender in the user directory (names for leaderboards and listings)
+application.add_handler(TypeHandler(Update, remember_user), group=-2)
+# Flood control runs before every other handler and drops commands from spammers
+application.add_handler(TypeHandler(Update, flood_guard), group=-1)
+
 application.add_handler(CommandHandler("start", start))
 application.add_handler(CommandHandler("update", update_message))  # Update message command
 application.add_handler(CommandHandler("emptyupdate", empty_update))
@@ -101,18 +158,19 @@ application.add_handler(CommandHandler("luck", luck))
 
 
 application.add_handler(CommandHandler("call", reply))
+application.add_handler(CommandHandler("broadcast", broadcast))
 
 # Inventory submission handlers
 application.add_handler(CommandHandler("finv", submit_inventory))
 application.add_handler(CommandHandler("linv", submit_inventory))
-application.add_handler(CommandHandler("taskresult", taskresult))
 application.add_handler(CommandHandler("bm", bm))
 application.add_handler(CommandHandler("addsudo", addsudo))
 application.add_handler(CommandHandler("rmsudo", removesudo))
 application.add_handler(CommandHandler("sdlist", sudolist))
 application.add_handler(CommandHandler("stats", stats))
+application.add_handler(CommandHandler("perf", perf_stats))
 application.add_handler(CallbackQueryHandler(handle_stats_buttons))
-application.add_handler(MessageHandler(filters.TEXT | filters.PHOTO | filters.VIDEO, handle_message))
+application.add_handler(MessageHandler((filters.TEXT | filters.PHOTO | filters.VIDEO) & black_market_filter, handle_message))
 
 
 # Run the bot